@@ -0,0 +1,329 @@
+"""
+Local stand-ins for the backend's external dependencies: an HTTP server
+mimicking api.data.gov.in, an in-memory Firestore, a chat model and a
+geocoder, each with configurable latency.
+"""
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Centres the fakes agree on (the fake geocoder returns these for city names)
+CITY_CENTRES = {
+    "bangalore": (12.9716, 77.5946), "mumbai": (19.0760, 72.8777), "delhi": (28.6139, 77.2090),
+    "chennai": (13.0827, 80.2707), "hyderabad": (17.3850, 78.4867), "kolkata": (22.5726, 88.3639),
+    "pune": (18.5204, 73.8567), "ahmedabad": (23.0225, 72.5714), "jaipur": (26.9124, 75.7873),
+    "lucknow": (26.8467, 80.9462),
+}
+CATEGORIES = ("pothole", "garbage", "water", "streetlight", "air", "noise")
+
+
+def _jitter(seed, spread):
+    digest = hashlib.md5(seed.encode("utf-8")).digest()
+    return (digest[0] / 255 - 0.5) * spread, (digest[1] / 255 - 0.5) * spread
+
+
+# --- OGD ---
+
+def _ogd_records(resource_id, filters, count):
+    place = next(iter(filters.values()), "Unknown")
+    records = []
+    for i in range(count):
+        records.append({
+            "city": place, "district": place, "district_name": place, "state_name": place,
+            "station": f"{place} Station {i}", "pollutant_id": ("PM2.5", "PM10", "NO2")[i % 3],
+            "pollutant_avg": str(40 + (i * 17) % 160), "actual_rainfall": "12.4", "normal_rainfall": "10.1",
+            "level": "8.5", "ph_level": "7.1", "N": "280", "last_update": "01-01-2025 10:00:00",
+            "resource_id": resource_id,
+        })
+    return records
+
+
+class FakeOGDServer:
+    """Serves /resource/<id>?filters[k]=v with synthetic records after `latency` seconds."""
+
+    def __init__(self, latency=0.2, records=20, host="127.0.0.1", port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                resource_id = url.path.rstrip("/").split("/")[-1]
+                filters = {
+                    k[len("filters["):-1]: v[0] for k, v in parse_qs(url.query).items() if k.startswith("filters[")
+                }
+                time.sleep(fake.latency)
+                limit = int(parse_qs(url.query).get("limit", [fake.records])[0])
+                body = json.dumps({
+                    "total": fake.records,
+                    "records": _ogd_records(resource_id, filters, min(limit, fake.records)),
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.latency = latency
+        self.records = records
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/resource"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# --- Firestore ---
+
+class FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+    def get(self, field_path):
+        return _get_path(self, field_path)
+
+
+_MISSING = object()
+
+
+def _get_path(doc, path, default=None):
+    if path == "__name__":
+        return doc.id
+    value = doc._data
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return default
+        value = value[part]
+    return value
+
+
+def _sort_key(value):
+    if value is None:
+        return (0, ())
+    if hasattr(value, "latitude"):
+        return (1, (value.latitude, value.longitude))
+    return (2, value) if isinstance(value, (int, float)) else (3, str(value))
+
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+}
+
+
+class FakeQuery:
+    """The subset of the Firestore query API the backend uses."""
+
+    def __init__(self, docs, filters=(), order=None, count=None, after=None, latency=0.0):
+        self._docs = docs
+        self._filters = filters
+        self._order = order
+        self._count = count
+        self._after = after
+        self._latency = latency
+
+    def _copy(self, **changes):
+        state = dict(docs=self._docs, filters=self._filters, order=self._order,
+                     count=self._count, after=self._after, latency=self._latency)
+        state.update(changes)
+        return FakeQuery(**state)
+
+    def select(self, fields):
+        return self
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+            # FieldFilter turns "== None" into the IS_NULL unary operator
+            if getattr(op_string, "name", None) == "IS_NULL":
+                op_string, value = "==", None
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path):
+        return self._copy(order=field_path if isinstance(field_path, str) else "__name__")
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    def start_after(self, doc):
+        return self._copy(after=doc)
+
+    def _matches(self, doc):
+        for field_path, op_string, value in self._filters:
+            actual = _get_path(doc, field_path, _MISSING)
+            if op_string == "==" and value is None:
+                # Like Firestore, a missing field never matches, not even null
+                if actual is not None:
+                    return False
+            elif actual is _MISSING:
+                return False
+            elif op_string == "in":
+                if actual not in value:
+                    return False
+            elif actual is None or not _OPS[op_string](_sort_key(actual), _sort_key(value)):
+                return False
+        return True
+
+    def stream(self):
+        time.sleep(self._latency)
+        docs = [doc for doc in self._docs if self._matches(doc)]
+        order = self._order or "__name__"
+        docs.sort(key=lambda doc: (_sort_key(_get_path(doc, order)), doc.id))
+        if self._after is not None:
+            after_key = (_sort_key(_get_path(self._after, order)), self._after.id)
+            docs = [doc for doc in docs if (_sort_key(_get_path(doc, order)), doc.id) > after_key]
+        return iter(docs[:self._count] if self._count else docs)
+
+    def on_snapshot(self, callback):
+        def deliver():
+            time.sleep(self._latency)
+            changes = [
+                SimpleNamespace(type=SimpleNamespace(name="ADDED"), document=doc)
+                for doc in self._docs if self._matches(doc)
+            ]
+            callback(None, changes, None)
+
+        thread = threading.Thread(target=deliver, daemon=True)
+        thread.start()
+        return SimpleNamespace(unsubscribe=lambda: None)
+
+
+class FakeFirestore:
+    """In-memory client whose 'issues' collection holds synthetic reports."""
+
+    def __init__(self, cities, reports_per_city=50, text_only_ratio=0.2, latency=0.05, seed=7):
+        from firebase_admin import firestore
+
+        rng = random.Random(seed)
+        self.docs = []
+        for city in cities:
+            lat, lng = CITY_CENTRES.get(city.lower(), (20.59, 78.96))
+            for i in range(reports_per_city):
+                has_coords = rng.random() >= text_only_ratio
+                neighbourhood = f"{city.title()} Ward {rng.randint(1, 40)}"
+                self.docs.append(FakeDoc(f"{city.lower()}-{i:05d}", {
+                    "category": rng.choice(CATEGORIES),
+                    "description": f"Reported issue #{i} near {neighbourhood}",
+                    "location": {
+                        "neighborhood": neighbourhood,
+                        "streetName": f"Street {rng.randint(1, 200)}",
+                        "geopoint": firestore.GeoPoint(
+                            lat + rng.uniform(-0.1, 0.1), lng + rng.uniform(-0.1, 0.1)
+                        ) if has_coords else None,
+                    },
+                    "photoUrl": "",
+                    "createdAt": f"2025-01-{1 + i % 28:02d}T10:00:00Z",
+                }))
+        self.latency = latency
+
+    def collection(self, name):
+        return FakeQuery(self.docs if name == "issues" else [], latency=self.latency)
+
+
+# --- LLM ---
+
+class FakeChatModel(BaseChatModel):
+    """
+    Answers extraction prompts with one marker per report line (echoing its
+    report_id) and anything else with a short canned reply, after `latency`
+    seconds. Streams the reply word by word.
+    """
+
+    latency: float = 0.5
+    token_delay: float = 0.01
+
+    @property
+    def _llm_type(self):
+        return "fake-city-brain"
+
+    def _reply(self, messages):
+        prompt = messages[-1].content
+        if "report_id" not in prompt:
+            return "Based on the sensor data, the AQI is moderate and potholes are the top citizen issue."
+        markers = []
+        for line in prompt.splitlines():
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                report = json.loads(line)
+            except ValueError:
+                continue
+            markers.append({
+                "report_id": report.get("id"),
+                "location_name": report.get("location_name") or "Unknown",
+                "category": report.get("category", "general"),
+                "description": report.get("description", ""),
+                "sentiment": "negative",
+            })
+        return json.dumps(markers)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+# --- Geocoder ---
+
+class FakeGeocoder:
+    """Nominatim look-alike: city names map to CITY_CENTRES, other queries land nearby."""
+
+    def __init__(self, latency=0.3, miss_ratio=0.1):
+        self.latency = latency
+        self.miss_ratio = miss_ratio
+        self.calls = 0
+
+    def geocode(self, query, timeout=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        parts = [part.strip().lower() for part in str(query).split(",")]
+        city = next((part for part in reversed(parts) if part in CITY_CENTRES), None)
+        if city is None:
+            return None
+        lat, lng = CITY_CENTRES[city]
+        if len(parts) > 1:
+            if hashlib.md5(query.encode("utf-8")).digest()[2] / 255 < self.miss_ratio:
+                return None
+            d_lat, d_lng = _jitter(query, 0.1)
+            lat, lng = lat + d_lat, lng + d_lng
+        return SimpleNamespace(latitude=lat, longitude=lng)
+
@@ -0,0 +1,246 @@
+"""
+Offline benchmark for the City Brain backend.
+
+Runs the real FastAPI `app` from main.py under uvicorn, with every external
+dependency replaced by a local fake from bench/fakes.py, then drives
+/analyze-city and /chat at a given concurrency and reports p50/p95/p99
+latency, throughput and peak RSS.
+
+    cd backend
+    python -m bench.run --concurrency 8 --analyze-requests 40 --chat-requests 200
+    python -m bench.run --save-baseline bench/baseline.json
+    python -m bench.run --baseline bench/baseline.json    # exits 1 on regression
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fakes import (
+    CITY_CENTRES, FakeOGDServer, FakeFirestore, FakeChatModel, FakeGeocoder,
+)
+
+CHAT_MESSAGES = (
+    "What is the AQI?", "What are the biggest problems?", "How much rain was there?",
+    "Is the groundwater level ok?", "Which area has the most potholes?",
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cities", default="bangalore,mumbai,delhi,chennai,pune",
+                        help="comma-separated cities (known to the fakes: %s)" % ",".join(CITY_CENTRES))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--analyze-requests", type=int, default=20)
+    parser.add_argument("--chat-requests", type=int, default=100)
+    parser.add_argument("--reports-per-city", type=int, default=50)
+    parser.add_argument("--ogd-latency", type=float, default=0.2)
+    parser.add_argument("--firestore-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--geocode-latency", type=float, default=0.3)
+    parser.add_argument("--nominatim-rps", type=float, default=20.0,
+                        help="rate budget for the fake geocoder (the real service allows 1)")
+    parser.add_argument("--no-index", action="store_true", help="disable the Firestore listener index")
+    parser.add_argument("--warmup", action="store_true", help="run the backend with WARMUP=1")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative slowdown against the baseline (default 0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="keep the backend's own logging")
+    return parser.parse_args(argv)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def start_backend(args, cities):
+    """Points the backend at the fakes, imports it, and serves it on a free port."""
+    ogd = FakeOGDServer(latency=args.ogd_latency).start()
+
+    os.environ.update({
+        "GOVT_DATA_API": "bench",
+        "GOOGLE_API_KEY": "bench",
+        "OGD_BASE_URL": ogd.base_url,
+        "GEOCODE_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="citybrain-bench-"), "geocode.sqlite3"),
+        "CITY_STORE_SHARED_PATH": "",
+        # Start cold every run
+        "CITY_SNAPSHOT_PATH": "",
+        "OGD_INGEST": "0",
+        "NOMINATIM_RPS": str(args.nominatim_rps),
+        "NOMINATIM_BURST": str(max(1, int(args.nominatim_rps))),
+        "CITIZEN_INDEX": "0" if args.no_index else "1",
+        "LOG_LEVEL": "INFO" if args.verbose else "WARNING",
+        "WARMUP": "1" if args.warmup else "0",
+        # Background refreshes would race the measured requests
+        "REFRESH_SCHEDULER": "0",
+    })
+
+    import uvicorn
+    import main
+    import deps
+    import geocoding
+
+    # The backend builds its clients lazily, so the fakes just need to be in
+    # place before the server starts
+    deps.db = FakeFirestore(cities, args.reports_per_city, latency=args.firestore_latency)
+    deps.llm = FakeChatModel(latency=args.llm_latency)
+    geocoder = FakeGeocoder(latency=args.geocode_latency)
+    geocoding.geolocator = geocoder
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    if not args.no_index:
+        # Wait for the listener's first snapshot so every run measures the same path
+        deadline = time.time() + 10
+        while not main.citizen_index.ready and time.time() < deadline:
+            time.sleep(0.05)
+
+    return f"http://127.0.0.1:{port}", server, ogd, geocoder, main.STARTUP_SECONDS
+
+
+def drive(base_url, path, payloads, concurrency):
+    """POSTs every payload with `concurrency` workers; returns (latencies, errors, wall seconds)."""
+    local = threading.local()
+
+    def one(payload):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{base_url}{path}", json=payload, timeout=120)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, payloads))
+    wall = time.perf_counter() - started
+
+    return [latency for latency, ok in results if ok], sum(1 for _, ok in results if not ok), wall
+
+
+def summarize(latencies, errors, wall):
+    count = len(latencies) + errors
+    return {
+        "requests": count,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "throughput_rps": round(count / wall, 2) if wall else 0.0,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lists every latency/throughput metric that regressed beyond `tolerance`."""
+    regressions = []
+    for scenario, metrics in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if before[metric] and metrics[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{scenario}.{metric}: {before[metric]} -> {metrics[metric]}")
+        if before["throughput_rps"] and metrics["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{scenario}.throughput_rps: {before['throughput_rps']} -> {metrics['throughput_rps']}"
+            )
+    for phase, seconds in results.get("startup", {}).items():
+        before = baseline.get("startup", {}).get(phase)
+        # Sub-100ms phases are too noisy to compare relatively
+        if before and seconds > 0.1 and seconds > before * (1 + tolerance):
+            regressions.append(f"startup.{phase}: {before}s -> {seconds}s")
+    if baseline.get("peak_rss_mb") and results["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {baseline['peak_rss_mb']} -> {results['peak_rss_mb']}")
+    return regressions
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    cities = [city.strip() for city in args.cities.split(",") if city.strip()]
+
+    base_url, server, ogd, geocoder, startup = start_backend(args, cities)
+
+    analyze_payloads = [{"city": cities[i % len(cities)]} for i in range(args.analyze_requests)]
+    cold = drive(base_url, "/analyze-city", [{"city": city} for city in cities], args.concurrency)
+    warm = drive(base_url, "/analyze-city", analyze_payloads, args.concurrency)
+
+    chat_payloads = [
+        {"city": cities[i % len(cities)], "message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)]}
+        for i in range(args.chat_requests)
+    ]
+    chat = drive(base_url, "/chat", chat_payloads, args.concurrency)
+
+    server.should_exit = True
+    ogd.stop()
+
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "baseline", "verbose")},
+        "scenarios": {
+            "analyze_cold": summarize(*cold),
+            "analyze_warm": summarize(*warm),
+            "chat": summarize(*chat),
+        },
+        "startup": {phase: round(seconds, 3) for phase, seconds in startup.items()},
+        "geocoder_calls": geocoder.calls,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    print(f"{'scenario':<14} {'reqs':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for name, m in results["scenarios"].items():
+        print(f"{name:<14} {m['requests']:>5} {m['errors']:>4} {m['p50_ms']:>9} {m['p95_ms']:>9} "
+              f"{m['p99_ms']:>9} {m['throughput_rps']:>8}")
+    print(f"geocoder calls: {results['geocoder_calls']}   peak RSS: {results['peak_rss_mb']} MB   "
+          f"import: {results['startup'].get('import', 0)}s   startup: {results['startup'].get('startup', 0)}s")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
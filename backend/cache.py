@@ -0,0 +1,96 @@
+"""
+Small thread-safe in-process caches shared by the backend modules.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU cache where every entry carries its own TTL.
+
+    An entry is *fresh* until its TTL runs out and then *stale* for another
+    `stale_ttl` seconds. Stale entries are still handed back by `lookup` so
+    callers can serve them instantly and refresh in the background
+    (stale-while-revalidate). Past the stale window the entry is dropped.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0, stale_ttl=0.0, name="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Returns `(value, is_fresh)` or `None` when there is nothing usable."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, stale_until = entry
+            if now >= stale_until:
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            if now < expires_at:
+                self.hits += 1
+                return value, True
+            self.stale_hits += 1
+            return value, False
+
+    def get(self, key, default=None):
+        """Fresh values only."""
+        found = self.lookup(key)
+        if found is None or not found[1]:
+            return default
+        return found[0]
+
+    def set(self, key, value, ttl=None, stale_ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at, expires_at + stale_ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drops every entry whose key matches `predicate`."""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,74 @@
+"""
+Compact, token-budgeted chat context built once per city snapshot.
+
+Raw OGD records carry every field the API returns; the assistant only needs
+a handful, so /chat splices in this precomputed block instead of pretty
+printing the whole gov_data on every message.
+"""
+import os
+import json
+
+from extraction import estimate_tokens
+
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "800"))
+CHAT_TOP_ISSUES = int(os.getenv("CHAT_TOP_ISSUES", "5"))
+
+# Fields the assistant uses from each gov_data section; sections without an
+# entry (or records missing all of them) keep their short scalar fields
+GOV_FIELDS = {
+    "aqi": ("value", "pollutant", "station", "max", "stations", "status"),
+    "rainfall": ("district", "actual_rainfall", "normal_rainfall", "departure", "date", "status"),
+    "power": ("state_name", "energy_requirement", "energy_availability", "peak_demand", "peak_met", "status"),
+    "water_level": ("level", "source", "station_name", "date", "status"),
+    "soil": ("ph_level", "N", "P", "K", "status"),
+}
+MAX_VALUE_CHARS = 60
+
+
+def _compact_section(name, record):
+    if not isinstance(record, dict):
+        return record
+    wanted = GOV_FIELDS.get(name, ())
+    picked = {k: record[k] for k in wanted if record.get(k) not in (None, "")}
+    if not picked:
+        picked = {
+            k: v for k, v in record.items()
+            if isinstance(v, (str, int, float)) and v != "" and len(str(v)) <= MAX_VALUE_CHARS
+        }
+    return picked
+
+
+def _issue_line(report):
+    description = " ".join(str(report.get("description", "")).split())[:100]
+    return f"- [{report.get('category', 'general')}] {report.get('location_name', 'Unknown')}: {description}"
+
+
+def build_chat_context(gov_data, citizen_stats, reports=(), budget=CHAT_CONTEXT_TOKENS, top_issues=CHAT_TOP_ISSUES):
+    """Returns `{"text": ..., "tokens": ...}` for a city snapshot."""
+    gov_lines = [
+        f"{name}: {json.dumps(_compact_section(name, record), default=str, separators=(',', ':'))}"
+        for name, record in gov_data.items()
+    ]
+    breakdown = json.dumps(citizen_stats.get("breakdown", {}), separators=(",", ":"))
+
+    head = "\n".join([
+        "--- REAL-TIME GOVT SENSOR DATA ---",
+        *gov_lines,
+        "",
+        "--- CITIZEN ISSUE REPORT STATS ---",
+        f"Total Reports: {citizen_stats.get('total', 0)}",
+        f"Breakdown: {breakdown}",
+    ])
+
+    # Most recent reports first, as many as fit the budget
+    recent = sorted(reports, key=lambda r: str(r.get("timestamp") or ""), reverse=True)[:top_issues]
+    issue_lines = [_issue_line(r) for r in recent]
+    while issue_lines:
+        text = "\n".join([head, "", "--- RECENT CITIZEN ISSUES ---", *issue_lines])
+        if estimate_tokens(text) <= budget:
+            break
+        issue_lines.pop()
+    else:
+        text = head
+
+    return {"text": text, "tokens": estimate_tokens(text)}
@@ -0,0 +1,250 @@
+"""
+In-memory, per-city index of citizen reports kept current by a Firestore
+snapshot listener.
+
+After the initial snapshot, reading a city's reports is a dict lookup
+(O(reports-in-city)) with no network round trip. Category counts and
+time-bucketed category rollups are maintained as changes arrive.
+"""
+import math
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _field(data, path):
+    """Reads a dotted Firestore field path ("location.city") from a dict."""
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def to_utc(timestamp):
+    """Report `createdAt` (datetime, ISO string or epoch seconds) as an aware UTC datetime, or None."""
+    if isinstance(timestamp, datetime):
+        value = timestamp
+    elif isinstance(timestamp, (int, float)):
+        value = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    elif isinstance(timestamp, str) and timestamp:
+        try:
+            value = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    else:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+class CategoryRollups:
+    """
+    Per-city, per-category counts bucketed by day and by hour.
+
+    Each report contributes once per city (keyed by its id), so adding a
+    report to a city again replaces its earlier contribution there. Window queries add up at most one
+    bucket per day (or hour for the 24h window), independent of how many
+    reports the city has.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._days = {}     # city_key -> {date: Counter(category)}
+        self._hours = {}    # city_key -> {hour start: Counter(category)}
+        self._docs = {}     # doc_id -> {city_key: (day, hour, category)}
+
+    def add(self, doc_id, city_key, category, timestamp):
+        created = to_utc(timestamp)
+        with self._lock:
+            self._remove(doc_id, city_key)
+            if created is None:
+                return
+            day = created.date()
+            hour = created.replace(minute=0, second=0, microsecond=0)
+            self._days.setdefault(city_key, {}).setdefault(day, Counter())[category] += 1
+            self._hours.setdefault(city_key, {}).setdefault(hour, Counter())[category] += 1
+            self._docs.setdefault(doc_id, {})[city_key] = (day, hour, category)
+
+    def remove(self, doc_id, city_key=None):
+        """Drops the report's contribution to `city_key`, or to every city."""
+        with self._lock:
+            for key in ([city_key] if city_key else list(self._docs.get(doc_id, {}))):
+                self._remove(doc_id, key)
+
+    def _remove(self, doc_id, city_key):
+        entries = self._docs.get(doc_id, {})
+        entry = entries.pop(city_key, None)
+        if not entries:
+            self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        day, hour, category = entry
+        for buckets, key in ((self._days[city_key], day), (self._hours[city_key], hour)):
+            buckets[key][category] -= 1
+            if buckets[key][category] <= 0:
+                del buckets[key][category]
+            if not buckets[key]:
+                del buckets[key]
+
+    def window(self, city_keys, hours, end=None):
+        """Category counts for the `hours` before `end` (default now)."""
+        end = end or datetime.now(timezone.utc)
+        total = Counter()
+        with self._lock:
+            if hours <= 48:
+                start = end - timedelta(hours=hours)
+                hour = start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+                while hour <= end:
+                    for city_key in city_keys:
+                        total.update(self._hours.get(city_key, {}).get(hour, {}))
+                    hour += timedelta(hours=1)
+            else:
+                last = end.date()
+                for offset in range(hours // 24):
+                    day = last - timedelta(days=offset)
+                    for city_key in city_keys:
+                        total.update(self._days.get(city_key, {}).get(day, {}))
+        return total
+
+    def daily_series(self, city_keys, days, end=None):
+        """`[(date, total reports)]` for the last `days` days, oldest first."""
+        last = (end or datetime.now(timezone.utc)).date()
+        series = []
+        with self._lock:
+            for offset in range(days - 1, -1, -1):
+                day = last - timedelta(days=offset)
+                series.append((day, sum(
+                    sum(self._days.get(city_key, {}).get(day, {}).values()) for city_key in city_keys
+                )))
+        return series
+
+
+class CitizenReportIndex:
+    """
+    Reports are assigned to a city either by the value of `city_field` or, when
+    that is not configured, by falling inside the bounding box of a tracked
+    city centre. Boxes may overlap (Bangalore/Bengaluru, Delhi/New Delhi), so
+    a report belongs to every box it falls in. A report with no city value
+    (or, with boxes, no coordinates) can't be tied to any city, so it is kept
+    out of every city's reports, counts and rollups, like the Firestore
+    queries do.
+
+    Changes are applied with `apply(change_type, doc_id, data)` where
+    `change_type` is "ADDED", "MODIFIED" or "REMOVED", the names Firestore uses
+    for `DocumentChange.type`, so a listener or a local fake can drive it.
+    """
+
+    def __init__(self, normalize, city_field="", radius_km=30.0):
+        self.normalize = normalize
+        self.city_field = city_field
+        self.radius_km = radius_km
+        self.ready = False
+        self._lock = threading.RLock()
+        self._by_city = {}          # city_key -> {doc_id: issue_obj}
+        self._counts = {}           # city_key -> Counter(category)
+        self._issues = {}           # doc_id -> issue_obj, placed or not
+        self._doc_cities = {}       # doc_id -> [city_key] (empty = outside every tracked city)
+        self._boxes = {}            # city_key -> (south, west, north, east)
+        self._watch = None
+        self.rollups = CategoryRollups()
+
+    # --- City tracking ---
+
+    def track_city(self, city_key, center):
+        """Registers a city centre so geolocated reports can be assigned to it."""
+        if self.city_field or city_key in self._boxes:
+            return
+        lat, lng = center
+        d_lat = self.radius_km / 111.0
+        d_lng = self.radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        with self._lock:
+            self._boxes[city_key] = (lat - d_lat, lng - d_lng, lat + d_lat, lng + d_lng)
+            # Including reports already assigned to an overlapping city
+            for doc_id, issue in self._issues.items():
+                if issue.get("has_coords") and self._in_box(issue, self._boxes[city_key]):
+                    self._add(city_key, doc_id, issue)
+
+    def is_tracked(self, city_key):
+        return bool(self.city_field) or city_key in self._boxes
+
+    @staticmethod
+    def _in_box(issue, box):
+        south, west, north, east = box
+        return south <= issue["lat"] <= north and west <= issue["lng"] <= east
+
+    def _locate(self, issue, data):
+        """Every city key the report belongs to (possibly none)."""
+        if self.city_field:
+            city = _field(data, self.city_field)
+            return [str(city).lower().strip()] if city else []
+        if not issue.get("has_coords"):
+            return []
+        return [city_key for city_key, box in self._boxes.items() if self._in_box(issue, box)]
+
+    # --- Change application ---
+
+    def _add(self, city_key, doc_id, issue):
+        if city_key in self._doc_cities.get(doc_id, ()):
+            return
+        self._by_city.setdefault(city_key, {})[doc_id] = issue
+        self._counts.setdefault(city_key, Counter())[issue["category"]] += 1
+        self._doc_cities.setdefault(doc_id, []).append(city_key)
+        self.rollups.add(doc_id, city_key, issue["category"], issue.get("timestamp"))
+
+    def _remove(self, doc_id):
+        self._issues.pop(doc_id, None)
+        for city_key in self._doc_cities.pop(doc_id, ()):
+            issue = self._by_city[city_key].pop(doc_id)
+            counts = self._counts[city_key]
+            counts[issue["category"]] -= 1
+            if counts[issue["category"]] <= 0:
+                del counts[issue["category"]]
+        self.rollups.remove(doc_id)
+
+    def apply(self, change_type, doc_id, data=None):
+        with self._lock:
+            self._remove(doc_id)
+            if change_type == "REMOVED":
+                return
+            issue = self.normalize(doc_id, data or {})
+            self._issues[doc_id] = issue
+            self._doc_cities[doc_id] = []
+            for city_key in self._locate(issue, data or {}):
+                self._add(city_key, doc_id, issue)
+
+    # --- Reads ---
+
+    def reports(self, city_key):
+        with self._lock:
+            return list(self._by_city.get(city_key, {}).values())
+
+    def category_counts(self, city_key):
+        with self._lock:
+            return dict(self._counts.get(city_key, Counter()))
+
+    def __len__(self):
+        return len(self._issues)
+
+    # --- Firestore feed ---
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        for change in changes:
+            self.apply(change.type.name, change.document.id, change.document.to_dict())
+        if not self.ready:
+            self.ready = True
+            logger.info("[INDEX] ✅ Citizen report index ready (%d reports).", len(self))
+
+    def listen(self, query):
+        """Starts a snapshot listener on `query` (e.g. the 'issues' collection)."""
+        self._watch = query.on_snapshot(self._on_snapshot)
+        return self._watch
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self.rollups = CategoryRollups()
+        self.ready = False
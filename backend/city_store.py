@@ -0,0 +1,233 @@
+"""
+Store for analyzed city data (gov data, citizen stats, markers) used by chat.
+
+An in-process LRU tier bounded by entry count, approximate bytes and TTL sits
+in front of an optional shared SQLite tier, so every uvicorn worker sees a
+city that any one of them analyzed. Each write bumps the city's version.
+
+Every write is also saved to an on-disk snapshot file, which is loaded back
+on startup so a restart keeps the analyzed cities (markers included).
+"""
+import os
+import json
+import time
+import zlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CITY_STORE_MAX_ENTRIES = int(os.getenv("CITY_STORE_MAX_ENTRIES", "64"))
+CITY_STORE_MAX_BYTES = int(os.getenv("CITY_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+CITY_STORE_TTL = float(os.getenv("CITY_STORE_TTL", str(6 * 3600)))
+# Path of the shared SQLite tier; empty keeps the store process-local
+CITY_STORE_SHARED_PATH = os.getenv("CITY_STORE_SHARED_PATH", "")
+# Snapshot file for warm restarts; empty disables it
+CITY_SNAPSHOT_PATH = os.getenv(
+    "CITY_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "city_snapshots.sqlite3")
+)
+
+
+def _encode(entry):
+    return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class SQLiteTier:
+    """Shared tier: one row per city, visible to every process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS city_data (
+                   city_key TEXT PRIMARY KEY,
+                   version INTEGER NOT NULL,
+                   payload TEXT NOT NULL,
+                   updated_at REAL NOT NULL
+               )"""
+        )
+        self._conn.commit()
+
+    def version(self, city_key):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM city_data WHERE city_key = ?", (city_key,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, city_key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, updated_at FROM city_data WHERE city_key = ?", (city_key,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, city_key, entry, min_version):
+        """Writes `entry` with a version above both `min_version` and the stored one."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT version FROM city_data WHERE city_key = ?", (city_key,)).fetchone()
+            version = max(row[0] if row else 0, min_version) + 1
+            entry = dict(entry, version=version)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO city_data (city_key, version, payload, updated_at) VALUES (?, ?, ?, ?)",
+                (city_key, version, _encode(entry), entry["updated_at"]),
+            )
+        return entry
+
+
+class SnapshotFile:
+    """
+    Latest entry per city as zlib-compressed JSON, written through on every
+    put and read back in full on startup.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS snapshots (
+                   city_key TEXT PRIMARY KEY,
+                   version INTEGER NOT NULL,
+                   updated_at REAL NOT NULL,
+                   payload BLOB NOT NULL
+               )"""
+        )
+        self._conn.commit()
+
+    def save(self, city_key, entry):
+        blob = zlib.compress(_encode(entry).encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots (city_key, version, updated_at, payload) VALUES (?, ?, ?, ?)",
+                (city_key, entry["version"], entry["updated_at"], blob),
+            )
+
+    def load(self, newer_than):
+        """Yields `(city_key, entry)` updated after `newer_than`, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT city_key, payload FROM snapshots WHERE updated_at > ? ORDER BY updated_at",
+                (newer_than,),
+            ).fetchall()
+        for city_key, blob in rows:
+            try:
+                yield city_key, json.loads(zlib.decompress(blob))
+            except (zlib.error, ValueError) as e:
+                logger.warning("[STORE] Skipping unreadable snapshot for %s: %s", city_key, e)
+
+
+class CityDataStore:
+    """
+    `put(city_key, entry)` stores a copy of `entry` stamped with `version` and
+    `updated_at` and returns it; `get(city_key)` returns the newest entry or None.
+    """
+
+    def __init__(self, max_entries=CITY_STORE_MAX_ENTRIES, max_bytes=CITY_STORE_MAX_BYTES,
+                 ttl=CITY_STORE_TTL, shared_path=CITY_STORE_SHARED_PATH, snapshot_path=CITY_SNAPSHOT_PATH):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared = SQLiteTier(shared_path) if shared_path else None
+        self.snapshots = SnapshotFile(snapshot_path) if snapshot_path else None
+        self._local = OrderedDict()     # city_key -> (entry, size_bytes)
+        self._versions = {}             # survives eviction so versions never go backwards
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    # --- Local tier ---
+
+    def _drop(self, city_key):
+        _, size = self._local.pop(city_key)
+        self._bytes -= size
+
+    def _keep(self, city_key, entry):
+        size = len(_encode(entry))
+        with self._lock:
+            if city_key in self._local:
+                self._drop(city_key)
+            self._local[city_key] = (entry, size)
+            self._bytes += size
+            self._versions[city_key] = max(self._versions.get(city_key, 0), entry["version"])
+            while self._local and (len(self._local) > self.max_entries or self._bytes > self.max_bytes):
+                evicted = next(iter(self._local))
+                self._drop(evicted)
+                logger.info("[STORE] Evicted %s (%d bytes in use).", evicted, self._bytes)
+
+    def _fresh(self, entry):
+        return time.time() - entry["updated_at"] < self.ttl
+
+    # --- Public API ---
+
+    def put(self, city_key, entry):
+        entry = dict(entry, updated_at=time.time())
+        with self._lock:
+            min_version = self._versions.get(city_key, 0)
+            if self.shared:
+                entry = self.shared.put(city_key, entry, min_version)
+            else:
+                entry["version"] = min_version + 1
+            self._keep(city_key, entry)
+        if self.snapshots:
+            try:
+                self.snapshots.save(city_key, entry)
+            except sqlite3.Error as e:
+                logger.warning("[STORE] Could not snapshot %s: %s", city_key, e)
+        return entry
+
+    def load_snapshots(self):
+        """Fills the local tier from the snapshot file; returns how many were loaded."""
+        if not self.snapshots:
+            return 0
+        loaded = 0
+        # Oldest first, so the newest cities survive if the bounds evict some
+        for city_key, entry in self.snapshots.load(time.time() - self.ttl):
+            with self._lock:
+                current = self._local.get(city_key)
+                if current and current[0]["version"] >= entry["version"]:
+                    continue
+                self._keep(city_key, entry)
+            loaded += 1
+        return loaded
+
+    def get(self, city_key, default=None):
+        with self._lock:
+            local = self._local.get(city_key)
+            if local and self._fresh(local[0]):
+                self._local.move_to_end(city_key)
+                entry = local[0]
+            else:
+                if local:
+                    self._drop(city_key)
+                entry = None
+
+        if self.shared:
+            # Another worker may have written a newer version
+            if entry is None or self.shared.version(city_key) > entry["version"]:
+                found = self.shared.get(city_key)
+                if found and self._fresh(found[0]):
+                    entry = found[0]
+                    self._keep(city_key, entry)
+
+        return entry if entry is not None else default
+
+    def version(self, city_key):
+        entry = self.get(city_key)
+        return entry["version"] if entry else 0
+
+    def __contains__(self, city_key):
+        return self.get(city_key) is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._local),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "shared": self.shared.path if self.shared else None,
+                "snapshots": self.snapshots.path if self.snapshots else None,
+            }
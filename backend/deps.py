@@ -0,0 +1,52 @@
+"""
+Lazily created, cached clients for the backend's external services.
+
+Nothing here runs at import time, so main.py can be imported (and workers
+can boot) without credentials; each client is built on first use or during
+the optional warm-up. Assigning `deps.db` / `deps.llm` beforehand replaces
+the real client (the benchmark fakes do this).
+"""
+import os
+import logging
+import threading
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+logger = logging.getLogger(__name__)
+
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", "serviceAccountKey.json")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+db = None
+llm = None
+_lock = threading.Lock()
+
+
+def get_db():
+    """Firestore client; initializes the Firebase app on first call."""
+    global db
+    if db is None:
+        with _lock:
+            if db is None:
+                if not firebase_admin._apps:
+                    try:
+                        cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+                        firebase_admin.initialize_app(cred)
+                        logger.info("🔥 Firebase Connected Successfully!")
+                    except Exception as e:
+                        logger.warning("⚠️ Firebase Error: %s", e)
+                db = firestore.client()
+    return db
+
+
+def get_llm():
+    global llm
+    if llm is None:
+        with _lock:
+            if llm is None:
+                llm = ChatGoogleGenerativeAI(
+                    model=GEMINI_MODEL, temperature=0.4, google_api_key=os.getenv("GOOGLE_API_KEY")
+                )
+    return llm
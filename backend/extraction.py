@@ -0,0 +1,134 @@
+"""
+Batched, concurrent and memoized marker extraction from citizen reports.
+
+Reports are packed into token-budgeted batches that go to the LLM together
+(bounded by LLM_EXTRACT_CONCURRENCY), and each report's markers are memoized
+by a hash of its content so unchanged reports are never sent twice.
+"""
+import os
+import json
+import logging
+import hashlib
+
+from langchain_core.messages import HumanMessage
+
+from cache import TTLCache
+from metrics import track_dependency, watch_cache
+
+logger = logging.getLogger(__name__)
+
+LLM_BATCH_TOKENS = int(os.getenv("LLM_BATCH_TOKENS", "1500"))
+LLM_EXTRACT_CONCURRENCY = int(os.getenv("LLM_EXTRACT_CONCURRENCY", "4"))
+EXTRACTION_MEMO_SIZE = int(os.getenv("EXTRACTION_MEMO_SIZE", "20000"))
+EXTRACTION_MEMO_TTL = float(os.getenv("EXTRACTION_MEMO_TTL", str(7 * 24 * 3600)))
+
+# Fields the model needs to place and classify a report
+PROMPT_FIELDS = ("id", "location_name", "street", "category", "description")
+
+extraction_memo = TTLCache(maxsize=EXTRACTION_MEMO_SIZE, ttl=EXTRACTION_MEMO_TTL, name="extraction")
+watch_cache(extraction_memo)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def report_line(report):
+    return json.dumps({k: report.get(k, "") for k in PROMPT_FIELDS}, ensure_ascii=False, separators=(",", ":"))
+
+
+def report_hash(city, line):
+    return hashlib.sha256(f"{city.lower().strip()}\n{line}".encode("utf-8")).hexdigest()
+
+
+def make_batches(items, token_budget=LLM_BATCH_TOKENS):
+    """
+    Greedily packs `(report_id, line)` pairs into batches of at most
+    `token_budget` tokens.
+    """
+    batches, current, used = [], [], 0
+    for report_id, line in items:
+        tokens = estimate_tokens(line)
+        if tokens > token_budget:
+            # One oversized report gets trimmed to fit a batch of its own
+            line = line[:token_budget * 4]
+            tokens = token_budget
+        if current and used + tokens > token_budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append((report_id, line))
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_prompt(city_name, lines):
+    reports = "\n".join(lines)
+    return f"""
+    City: {city_name}
+    Citizen Reports (one JSON object per line):
+    {reports}
+    
+    TASK: Return a JSON Array of map markers based ONLY on the citizen reports.
+    - Use specific location names found in the reports.
+    - Determine sentiment (negative/positive).
+    - Copy the "id" of the report each marker comes from into "report_id".
+    
+    JSON ONLY.
+    """
+
+
+def extract_markers(chain, city_name, reports):
+    """
+    Returns the AI-inferred markers for `reports`, calling `chain` (an
+    `llm | JsonOutputParser()` runnable) only for reports not seen before.
+    """
+    markers = []
+    pending = {}    # report id -> (memo key, prompt line)
+
+    for report in reports:
+        line = report_line(report)
+        key = report_hash(city_name, line)
+        cached = extraction_memo.get(key)
+        if cached is not None:
+            # Copies, since cartographer fills in coordinates on the markers
+            markers.extend(dict(item) for item in cached)
+        else:
+            pending[str(report.get("id", ""))] = (key, line)
+
+    if not pending:
+        return markers
+
+    batches = make_batches((report_id, line) for report_id, (_, line) in pending.items())
+    logger.info("[AI] 🧩 %d new reports in %d batches (%d memoized).", len(pending), len(batches), len(reports) - len(pending))
+
+    prompts = [[HumanMessage(content=build_prompt(city_name, [line for _, line in batch]))] for batch in batches]
+    with track_dependency("gemini", "extract"):
+        responses = chain.batch(
+            prompts, config={"max_concurrency": LLM_EXTRACT_CONCURRENCY}, return_exceptions=True
+        )
+
+    for batch, response in zip(batches, responses):
+        if isinstance(response, Exception) or not isinstance(response, list):
+            logger.error("AI Error: %s", response)
+            continue
+
+        by_report = {report_id: [] for report_id, _ in batch}
+        orphans = []
+        for item in response:
+            if not isinstance(item, dict):
+                continue
+            report_id = str(item.get("report_id", ""))
+            (by_report[report_id] if report_id in by_report else orphans).append(item)
+
+        markers.extend(orphans)
+        for report_id, items in by_report.items():
+            markers.extend(items)
+            # Without attribution we can't tell which report an orphan came
+            # from, so reports with no markers are only memoized when none leaked
+            if items or not orphans:
+                extraction_memo.set(pending[report_id][0], [dict(item) for item in items])
+
+    return markers
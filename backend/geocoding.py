@@ -0,0 +1,253 @@
+"""
+Nominatim geocoding behind a persistent SQLite cache and a shared,
+rate-limited lookup queue.
+
+Lookups are keyed by the normalized query string. Misses are cached too
+(for GEOCODE_NEGATIVE_TTL seconds), so repeat analyses of a city do no
+network geocoding at all.
+"""
+import os
+import time
+import queue
+import logging
+import asyncio
+import sqlite3
+import itertools
+import threading
+from concurrent.futures import Future
+
+from geopy.geocoders import Nominatim
+
+from metrics import REGISTRY, track_dependency
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_CACHE_PATH = os.getenv(
+    "GEOCODE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "geocode_cache.sqlite3")
+)
+GEOCODE_NEGATIVE_TTL = float(os.getenv("GEOCODE_NEGATIVE_TTL", str(7 * 24 * 3600)))
+
+# Global Nominatim budget (their usage policy allows 1 request per second)
+NOMINATIM_RPS = float(os.getenv("NOMINATIM_RPS", "1"))
+NOMINATIM_BURST = int(os.getenv("NOMINATIM_BURST", "1"))
+GEOCODE_WORKERS = int(os.getenv("GEOCODE_WORKERS", "2"))
+GEOCODE_QUEUE_TIMEOUT = float(os.getenv("GEOCODE_QUEUE_TIMEOUT", "30"))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Created on first lookup (see get_geolocator)
+geolocator = None
+
+
+def get_geolocator():
+    global geolocator
+    if geolocator is None:
+        geolocator = Nominatim(user_agent="hackathon_city_brain_v2", timeout=10)
+    return geolocator
+
+
+def normalize_query(query):
+    return " ".join(str(query).lower().replace(",", ", ").split())
+
+
+class GeocodeCache:
+    """query -> (lat, lng) on disk; a row with found=0 is a cached miss."""
+
+    def __init__(self, path=GEOCODE_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocode (
+                   query TEXT PRIMARY KEY,
+                   lat REAL,
+                   lng REAL,
+                   found INTEGER NOT NULL,
+                   updated_at REAL NOT NULL
+               )"""
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query):
+        """Returns `(hit, coords)`; coords is None for a cached miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lng, found, updated_at FROM geocode WHERE query = ?", (query,)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None
+
+        lat, lng, found, updated_at = row
+        if found:
+            self.hits += 1
+            return True, (lat, lng)
+        if time.time() - updated_at < GEOCODE_NEGATIVE_TTL:
+            self.hits += 1
+            return True, None
+        self.misses += 1
+        return False, None
+
+    def put(self, query, coords):
+        lat, lng = coords if coords else (None, None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (query, lat, lng, found, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (query, lat, lng, 1 if coords else 0, time.time()),
+            )
+            self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GeocodeCache()
+    return _cache
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, up to `burst` saved up."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class GeocodingService:
+    """
+    Process-wide queue in front of Nominatim.
+
+    Every network lookup in the process passes through one token bucket, so
+    the global budget holds no matter how many analyses run at once.
+    Identical queries in flight share one Future, and interactive lookups are
+    served before background ones.
+    """
+
+    def __init__(self, rate=NOMINATIM_RPS, burst=NOMINATIM_BURST, workers=GEOCODE_WORKERS):
+        self.bucket = TokenBucket(rate, burst)
+        self._queue = queue.PriorityQueue()
+        self._inflight = {}     # normalized query -> Future
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"geocode-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, query, timeout=None, priority=PRIORITY_INTERACTIVE):
+        key = normalize_query(query)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = Future()
+                self._inflight[key] = future
+            # A duplicate at higher priority is queued again; whichever copy
+            # runs first resolves the Future and the other is skipped
+            self._queue.put((priority, next(self._seq), key, query, timeout, future))
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            priority, _, key, query, timeout, future = self._queue.get()
+            with self._lock:
+                # Skip duplicates whose twin already ran (or is running)
+                if future.done() or future.running() or not future.set_running_or_notify_cancel():
+                    continue
+
+            self.bucket.acquire()
+            try:
+                logger.debug("[GEO] Looking up: %s", query)
+                with track_dependency("nominatim", "geocode"):
+                    geocoder = get_geolocator()
+                    loc = geocoder.geocode(query, timeout=timeout) if timeout else geocoder.geocode(query)
+                coords = (loc.latitude, loc.longitude) if loc else None
+                get_cache().put(key, coords)
+                future.set_result(coords)
+            except Exception as e:
+                # Network errors are not cached
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GeocodingService()
+    return _service
+
+
+def _cached(query):
+    hit, coords = get_cache().get(normalize_query(query))
+    return hit, (list(coords) if coords else None)
+
+
+def geocode(query, timeout=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Returns `[lat, lng]` or None. Cache hits return immediately; misses wait
+    their turn in the shared queue (raising TimeoutError after
+    GEOCODE_QUEUE_TIMEOUT seconds).
+    """
+    hit, coords = _cached(query)
+    if hit:
+        return coords
+
+    coords = get_service().submit(query, timeout, priority).result(timeout=GEOCODE_QUEUE_TIMEOUT)
+    return list(coords) if coords else None
+
+
+async def ageocode(query, timeout=None, priority=PRIORITY_INTERACTIVE):
+    """Async variant of `geocode` for callers on the event loop."""
+    hit, coords = _cached(query)
+    if hit:
+        return coords
+
+    future = get_service().submit(query, timeout, priority)
+    coords = await asyncio.wait_for(asyncio.wrap_future(future), GEOCODE_QUEUE_TIMEOUT)
+    return list(coords) if coords else None
+
+
+REGISTRY.gauge(
+    "citybrain_geocode_cache_lookups", "Lookups on the SQLite geocode cache by outcome.", ("outcome",),
+    lambda: {("hit",): get_cache().hits, ("miss",): get_cache().misses},
+)
+REGISTRY.gauge(
+    "citybrain_geocode_queue_depth", "Lookups waiting for the Nominatim rate limiter.", (),
+    lambda: {(): get_service().queue_depth()} if _service else {(): 0},
+)
@@ -0,0 +1,218 @@
+"""
+Admission control for every Gemini call.
+
+Calls wait in one priority queue (chat before analysis before background
+refreshes) and are admitted while fewer than LLM_MAX_CONCURRENCY calls are in
+flight and the tokens-per-minute bucket covers their estimated size. A call
+whose expected queue wait exceeds its priority's deadline is refused up front
+with `LLMOverloaded`, which carries a retry-after in seconds, rather than
+piling up and surfacing later as a Gemini quota error.
+"""
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager, asynccontextmanager
+
+from langchain_core.runnables import RunnableLambda
+
+from metrics import REGISTRY
+from extraction import estimate_tokens
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "250000"))
+# Slots only chat may take, so a burst of analyses can't make chats wait
+LLM_CHAT_RESERVED = int(os.getenv("LLM_CHAT_RESERVED", "1"))
+# Budgeted per call on top of the prompt, since output size isn't known upfront
+LLM_OUTPUT_TOKENS = int(os.getenv("LLM_OUTPUT_TOKENS", "500"))
+
+PRIORITY_CHAT = 0
+PRIORITY_ANALYSIS = 5
+PRIORITY_BACKGROUND = 10
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_ANALYSIS: "analysis", PRIORITY_BACKGROUND: "background"}
+
+# Longest a call of each priority may wait in the queue
+LLM_MAX_WAIT = {
+    PRIORITY_CHAT: float(os.getenv("LLM_CHAT_MAX_WAIT", "10")),
+    PRIORITY_ANALYSIS: float(os.getenv("LLM_ANALYSIS_MAX_WAIT", "60")),
+    PRIORITY_BACKGROUND: float(os.getenv("LLM_BACKGROUND_MAX_WAIT", "300")),
+}
+
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    "citybrain_llm_queue_wait_seconds", "Time LLM calls spent queued for admission.", ("priority",)
+)
+LLM_SHED = REGISTRY.counter(
+    "citybrain_llm_shed_total", "LLM calls refused because the queue wait would exceed their deadline.", ("priority",)
+)
+
+
+class LLMOverloaded(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"LLM capacity exhausted, retry after {self.retry_after}s")
+
+
+class AdmissionController:
+    """
+    `slot(priority, tokens)` / `aslot(...)` hold one admission for the body of
+    a `with` block. A dispatcher thread admits queued calls in priority order.
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_wait=LLM_MAX_WAIT):
+        self.max_concurrency = max_concurrency
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = tokens_per_minute
+        self.max_wait = max_wait
+        # Never reserve every slot, or nothing but chat could run
+        self.chat_reserved = min(LLM_CHAT_RESERVED, max_concurrency - 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._queue = []            # (priority, seq, tokens, future, enqueued_at)
+        self._seq = itertools.count()
+        self._active = 0
+        self._service_time = 2.0    # moving average of seconds a call holds its slot
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # --- Dispatcher ---
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                self._refill()
+                timeout = None
+                while self._queue and self._active < self.max_concurrency:
+                    priority, _, tokens, future, enqueued_at = self._queue[0]
+                    if future.cancelled():
+                        heapq.heappop(self._queue)
+                        continue
+                    if priority > PRIORITY_CHAT and self._active >= self.max_concurrency - self.chat_reserved:
+                        break
+                    needed = min(tokens, self.capacity)
+                    if self._tokens < needed:
+                        timeout = (needed - self._tokens) / self.rate
+                        break
+                    heapq.heappop(self._queue)
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    self._tokens -= needed
+                    self._active += 1
+                    LLM_QUEUE_WAIT.observe(
+                        time.monotonic() - enqueued_at, priority=PRIORITY_NAMES.get(priority, str(priority))
+                    )
+                    future.set_result(None)
+                self._cond.wait(timeout)
+
+    def _ensure_dispatcher(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch, name="llm-admission", daemon=True)
+            self._thread.start()
+
+    # --- Queueing ---
+
+    def expected_wait(self, priority, tokens):
+        """Rough queue wait for a new call: the longer of the slot and token waits."""
+        ahead = [entry for entry in self._queue if entry[0] <= priority and not entry[3].cancelled()]
+        waves = (len(ahead) + self._active + 1) / self.max_concurrency
+        slot_wait = max(0.0, waves - 1) * self._service_time
+        token_wait = max(0.0, sum(entry[2] for entry in ahead) + tokens - self._tokens) / self.rate
+        return max(slot_wait, token_wait)
+
+    def _enqueue(self, priority, tokens):
+        self._ensure_dispatcher()
+        with self._cond:
+            self._refill()
+            expected = self.expected_wait(priority, tokens)
+            if expected > self.max_wait.get(priority, self.max_wait[PRIORITY_BACKGROUND]):
+                LLM_SHED.inc(priority=PRIORITY_NAMES.get(priority, str(priority)))
+                raise LLMOverloaded(expected)
+            future = Future()
+            heapq.heappush(self._queue, (priority, next(self._seq), tokens, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def _give_up(self, future, priority):
+        """Cancels a call that waited past its deadline, unless it was just admitted."""
+        if future.cancel():
+            LLM_SHED.inc(priority=PRIORITY_NAMES.get(priority, str(priority)))
+            raise LLMOverloaded(self._service_time)
+
+    def _release(self, held_for=None):
+        with self._cond:
+            self._active -= 1
+            if held_for is not None:
+                self._service_time = 0.8 * self._service_time + 0.2 * held_for
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, priority, tokens=LLM_OUTPUT_TOKENS):
+        future = self._enqueue(priority, tokens)
+        try:
+            future.result(timeout=self.max_wait.get(priority))
+        except FutureTimeout:
+            self._give_up(future, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aslot(self, priority, tokens=LLM_OUTPUT_TOKENS):
+        future = self._enqueue(priority, tokens)
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.max_wait.get(priority))
+        except asyncio.TimeoutError:
+            self._give_up(future, priority)
+        except asyncio.CancelledError:
+            # Caller went away; hand back the slot if it was granted meanwhile
+            if not future.cancel():
+                self._release()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def gate(self, runnable, priority):
+        """`runnable` with every invoke (including via `.batch`) admitted first."""
+        def admitted(messages):
+            if isinstance(messages, str):
+                text = messages
+            else:
+                text = "".join(str(getattr(message, "content", message)) for message in messages)
+            with self.slot(priority, estimate_tokens(text) + LLM_OUTPUT_TOKENS):
+                return runnable.invoke(messages)
+        return RunnableLambda(admitted)
+
+    def stats(self):
+        with self._cond:
+            depth = {}
+            for entry in self._queue:
+                if not entry[3].cancelled():
+                    name = PRIORITY_NAMES.get(entry[0], str(entry[0]))
+                    depth[name] = depth.get(name, 0) + 1
+            return {"active": self._active, "queued": depth, "tokens_available": self._tokens}
+
+
+admission = AdmissionController()
+
+REGISTRY.gauge(
+    "citybrain_llm_queue_depth", "LLM calls waiting for admission, by priority.", ("priority",),
+    lambda: {(name,): admission.stats()["queued"].get(name, 0) for name in PRIORITY_NAMES.values()},
+)
+REGISTRY.gauge(
+    "citybrain_llm_active", "LLM calls currently admitted.", (),
+    lambda: {(): admission.stats()["active"]},
+)
@@ -1,119 +1,98 @@
-import os
 import time
+
+# Import time is measured from here and exported on /metrics
+IMPORT_STARTED = time.perf_counter()
+
+import os
+import math
+import asyncio
+import logging
 import uvicorn
-import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import firestore
 from typing import TypedDict, List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-import requests
 import json
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import random 
 
 # FastAPI
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 
 # AI & Logic
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 from langchain_core.output_parsers import JsonOutputParser
-from langgraph.graph import StateGraph, END
-
-# Geocoding
-from geopy.geocoders import Nominatim
+from langgraph.graph import StateGraph, START, END
+from langgraph.config import get_stream_writer
 
 # Load Env
 load_dotenv()
 
-# --- CONFIGURATION ---
-API_KEY = os.getenv("GOOGLE_API_KEY")
-
-# 1. INITIALIZE FIREBASE
-if not firebase_admin._apps:
-    try:
-        cred = credentials.Certificate("serviceAccountKey.json")
-        firebase_admin.initialize_app(cred)
-        print("🔥 Firebase Connected Successfully!")
-    except Exception as e:
-        print(f"⚠️ Firebase Error: {e}")
-
-db = firestore.client()
+# Structured, leveled logging (LOG_LEVEL=DEBUG shows per-request API details)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+logger = logging.getLogger("citybrain")
+
+# Local modules (read their settings from the env loaded above)
+from ogd_client import fan_out
+from ogd_store import Ingester, lookup as ogd_lookup
+import ogd_store
+from geocoding import geocode, ageocode, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from citizen_index import CitizenReportIndex
+from extraction import extract_markers, estimate_tokens
+from singleflight import SingleFlight
+from city_store import CityDataStore
+from cache import TTLCache
+from chat_context import build_chat_context
+from metrics import REGISTRY, instrument_node, track_dependency, watch_cache
+from deps import get_db, get_llm
+from spatial import consolidate_reports, MarkerGrid
+from payloads import payload_etag, etag_matches, assign_marker_ids, diff_markers, encode_response
+from refresh import RefreshScheduler, REFRESH_CONCURRENCY
+from llm_admission import admission, LLMOverloaded, LLM_OUTPUT_TOKENS
+import llm_admission
+import ogd_client
+import geocoding
 
-# Initialize AI & Geocoder
-geolocator = Nominatim(user_agent="hackathon_city_brain_v2", timeout=10)
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.4, google_api_key=API_KEY)
+# --- CONFIGURATION ---
+# Firebase, Gemini and the geocoder are created lazily on first use (see
+# deps.py / geocoding.py); WARMUP=1 builds them during startup instead.
+WARMUP = os.getenv("WARMUP", "0") == "1"
 
 # ### NEW CHANGE: GLOBAL IN-MEMORY STORE ###
-# This dictionary will store the data for cities we have analyzed.
-# Format: { "mumbai": { "gov_data": {...}, "citizen_stats": {...} } }
-CITY_DATA_STORE = {} 
+# This store keeps the data for cities we have analyzed (bounded LRU+TTL,
+# optionally shared across workers; see city_store.py).
+# Format: { "mumbai": { "gov_data": {...}, "citizen_stats": {...}, "version": 3 } }
+CITY_DATA_STORE = CityDataStore()
 
 # --- DATA SOURCE FUNCTIONS (Standard) ---
 
+# Also the seed list for the background refresh scheduler
+CITY_STATES = {
+    "bangalore": "Karnataka", "bengaluru": "Karnataka",
+    "mumbai": "Maharashtra", "pune": "Maharashtra", "nagpur": "Maharashtra",
+    "delhi": "Delhi", "new delhi": "Delhi",
+    "chennai": "Tamil Nadu", "coimbatore": "Tamil Nadu",
+    "hyderabad": "Telangana", "kolkata": "West Bengal",
+    "ahmedabad": "Gujarat", "surat": "Gujarat",
+    "jaipur": "Rajasthan", "lucknow": "Uttar Pradesh", "kanpur": "Uttar Pradesh",
+    "indore": "Madhya Pradesh", "bhopal": "Madhya Pradesh"
+}
+
+# Alternate spellings of a city listed above under another key
+CITY_ALIASES = {"bengaluru": "bangalore", "new delhi": "delhi"}
+
 def get_state_from_city(city_name):
     city_lower = city_name.lower().strip()
-    mapping = {
-        "bangalore": "Karnataka", "bengaluru": "Karnataka",
-        "mumbai": "Maharashtra", "pune": "Maharashtra", "nagpur": "Maharashtra",
-        "delhi": "Delhi", "new delhi": "Delhi",
-        "chennai": "Tamil Nadu", "coimbatore": "Tamil Nadu",
-        "hyderabad": "Telangana", "kolkata": "West Bengal",
-        "ahmedabad": "Gujarat", "surat": "Gujarat",
-        "jaipur": "Rajasthan", "lucknow": "Uttar Pradesh", "kanpur": "Uttar Pradesh",
-        "indore": "Madhya Pradesh", "bhopal": "Madhya Pradesh"
-    }
-    return mapping.get(city_lower, "")
-
-def fetch_ogd_resource(resource_id, filters=None):
-    """Generic function to hit api.data.gov.in with DEBUG logging"""
-    api_key = os.getenv("GOVT_DATA_API")
-    if not api_key:
-        print("⚠️ GOVT_DATA_API key missing in .env")
-        return None
-
-    base_url = f"https://api.data.gov.in/resource/{resource_id}"
-    
-    # Use limit 20 to increase odds of finding valid data
-    params = {
-        "api-key": api_key,
-        "format": "json",
-        "limit": 20 
-    }
-    
-    if filters:
-        for k, v in filters.items():
-            params[f"filters[{k}]"] = v
-
-    # --- LOGGING POINT 1: What are we asking for? ---
-    print(f"\n   [API REQUEST] ID: {resource_id} | Filters: {filters}")
-
-    try:
-        response = requests.get(base_url, params=params, timeout=5)
-        
-        # --- LOGGING POINT 2: Did it work? ---
-        print(f"   [API RESPONSE] Status: {response.status_code}")
-        
-        if response.status_code == 200:
-            data = response.json()
-            records = data.get("records", [])
-            
-            # --- LOGGING POINT 3: What did we get? ---
-            print(f"   [API DATA] Found {len(records)} records.")
-            if records:
-                # Print the first record to see if fields like 'pollutant_avg' are actually present
-                print(f"   [API SAMPLE] {json.dumps(records[0], indent=2)}")
-            else:
-                print("   [API WARNING] returned 0 records (Check city spelling or API limit).")
-                
-            return records
-        else:
-            print(f"   [API ERROR] Failed {resource_id}: {response.status_code}")
-    except Exception as e:
-        print(f"   [API EXCEPTION] Error {resource_id}: {e}")
-    
-    return []
+    return CITY_STATES.get(city_lower, "")
 
 # --- NEW DATA FETCHERS ---
 
@@ -125,7 +104,7 @@ def fetch_ground_water(district, state):
     # REPLACE THIS WITH A REAL RESOURCE ID FROM OGD
     RESOURCE_ID = "d23c7de6-867b-4679-b8c7-36ee8a95b15b" 
     
-    print(f"   [API] 💧 Checking Ground Water for {district}...")
+    logger.debug("[API] 💧 Checking Ground Water for %s...", district)
     
     # Groundwater is usually filed by District, not City
     filters = {"district_name": district, "state_name": state}
@@ -134,7 +113,7 @@ def fetch_ground_water(district, state):
     if RESOURCE_ID == "resource_id_for_ground_water_here":
         return {"status": "No Resource ID Configured", "level": "N/A"}
 
-    data = fetch_ogd_resource(RESOURCE_ID, filters)
+    data = ogd_lookup(RESOURCE_ID, filters)
     return data[0] if data else {"status": "No Data"}
 
 def fetch_soil_quality(district, state):
@@ -145,20 +124,59 @@ def fetch_soil_quality(district, state):
     # REPLACE THIS WITH A REAL RESOURCE ID FROM OGD
     RESOURCE_ID = "4554a3c8-74e3-4f93-8727-8fd92161e345"
     
-    print(f"   [API] 🌱 Checking Soil Quality for {district}...")
+    logger.debug("[API] 🌱 Checking Soil Quality for %s...", district)
     
     filters = {"district_name": district}
     
     if RESOURCE_ID == "resource_id_for_soil_health_here":
         return {"status": "No Resource ID Configured", "ph_level": "N/A"}
 
-    data = fetch_ogd_resource(RESOURCE_ID, filters)
+    data = ogd_lookup(RESOURCE_ID, filters)
     return data[0] if data else {"status": "No Data"}
 
+def parse_reading(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def summarize_aqi(records):
+    """
+    City AQI across all stations: PM2.5 readings if any station reports them,
+    else PM10, else whatever pollutant comes first. The value is the mean over
+    those stations and `station` names the worst one.
+    """
+    for pollutant in ("PM2.5", "PM10", records[0].get("pollutant_id")):
+        readings = [
+            (parse_reading(r.get("pollutant_avg")), r) for r in records if r.get("pollutant_id") == pollutant
+        ]
+        readings = [(value, r) for value, r in readings if value is not None]
+        if readings:
+            break
+    else:
+        # Nothing numeric: keep the old first-station answer
+        first = records[0]
+        return {
+            "value": first.get('pollutant_avg'),
+            "pollutant": first.get('pollutant_id'),
+            "station": first.get('station'),
+            "status": "Active"
+        }
+
+    worst_value, worst = max(readings, key=lambda reading: reading[0])
+    return {
+        "value": round(sum(value for value, _ in readings) / len(readings), 1),
+        "pollutant": pollutant,
+        "station": worst.get('station'),
+        "max": worst_value,
+        "stations": len(readings),
+        "status": "Active"
+    }
+
 # --- UPDATE MAIN AGGREGATOR ---
 
 def fetch_gov_api_data(city: str):
-    print(f"\n   [API] 📡 Connecting to Govt Data for {city}...")
+    logger.info("[API] 📡 Connecting to Govt Data for %s...", city)
     state = get_state_from_city(city)
     
     # OGD API often uses 'District' for Water/Soil, which is usually the City name
@@ -166,39 +184,52 @@ def fetch_gov_api_data(city: str):
     
     compiled_data = {}
 
+    # Fire every resource at once over the shared pool. The Bengaluru retry is
+    # sent alongside the first AQI call instead of after it fails.
+    jobs = {
+        "aqi": lambda: ogd_lookup("3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69", {"city": city}),
+        "rainfall": lambda: ogd_lookup("6c05cd1b-ed59-40c2-bc31-e314f39c6971", {"district": city}),
+        "water_level": lambda: fetch_ground_water(district, state),
+        "soil": lambda: fetch_soil_quality(district, state),
+    }
+    if city.lower() == "bangalore":
+        jobs["aqi_retry"] = lambda: ogd_lookup("3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69", {"city": "Bengaluru"})
+    if state:
+        jobs["power"] = lambda: ogd_lookup("8c55baee-3e42-457f-92c4-a0005e954bcc", {"state_name": state})
+
+    results, missed = fan_out(jobs)
+
     # 1. AQI (Existing)
-    aqi_data = fetch_ogd_resource("3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69", {"city": city})
-    if not aqi_data and city.lower() == "bangalore":
-         aqi_data = fetch_ogd_resource("3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69", {"city": "Bengaluru"})
+    aqi_data = results.get("aqi") or results.get("aqi_retry")
     
     if aqi_data:
-        best_station = aqi_data[0]
-        # ... (Keep your existing AQI logic here) ...
-        compiled_data["aqi"] = {
-            "value": best_station.get('pollutant_avg'),
-            "pollutant": best_station.get('pollutant_id'),
-            "station": best_station.get('station'),
-            "status": "Active"
-        }
+        # Every station in the city when the resource is ingested locally
+        compiled_data["aqi"] = summarize_aqi(aqi_data)
+    elif "aqi" in missed:
+        compiled_data["aqi"] = {"status": "Timed Out", "value": "N/A"}
     else:
         compiled_data["aqi"] = {"status": "Data Unavailable", "value": "N/A"}
 
     # 2. Rainfall (Existing)
-    rain_data = fetch_ogd_resource("6c05cd1b-ed59-40c2-bc31-e314f39c6971", {"district": city})
+    rain_data = results.get("rainfall")
     compiled_data["rainfall"] = rain_data[0] if rain_data else {"status": "No Recent Data"}
 
     # 3. Power (Existing)
     if state:
-        power_data = fetch_ogd_resource("8c55baee-3e42-457f-92c4-a0005e954bcc", {"state_name": state})
+        power_data = results.get("power")
         compiled_data["power"] = power_data[0] if power_data else {"status": "No Data"}
         
     # --- NEW DATA POINTS ---
     
     # 4. Water Levels
-    compiled_data["water_level"] = fetch_ground_water(district, state)
+    compiled_data["water_level"] = results.get("water_level") or {"status": "Timed Out", "level": "N/A"}
 
     # 5. Soil Quality
-    compiled_data["soil"] = fetch_soil_quality(district, state)
+    compiled_data["soil"] = results.get("soil") or {"status": "Timed Out", "ph_level": "N/A"}
+
+    # Resources that missed the deadline are listed so callers know the result is partial
+    if missed:
+        compiled_data["partial"] = sorted(missed)
 
     return compiled_data
 
@@ -259,60 +290,229 @@ def fetch_gov_api_data(city: str):
 
 #     return compiled_data
 # /
-def fetch_real_firebase_issues(city: str):
-    print(f"   [DB] 📲 Fetching Citizen Reports from Firebase...")
+# Only the fields issue_obj reads are pulled from Firestore
+ISSUE_FIELDS = ["category", "description", "location", "photoUrl", "createdAt"]
+
+# Optional document field holding the city name (e.g. "location.city"). When
+# set, reports are filtered by equality on it; otherwise by a bounding box of
+# FIRESTORE_CITY_RADIUS_KM around the city centre on location.geopoint. In
+# box mode a text-only report (no geopoint) can't be tied to any city, so it
+# is left out of every city's stats and extraction; set FIRESTORE_CITY_FIELD
+# to include them.
+FIRESTORE_CITY_FIELD = os.getenv("FIRESTORE_CITY_FIELD", "")
+FIRESTORE_CITY_RADIUS_KM = float(os.getenv("FIRESTORE_CITY_RADIUS_KM", "30"))
+FIRESTORE_PAGE_SIZE = int(os.getenv("FIRESTORE_PAGE_SIZE", "200"))
+FIRESTORE_MAX_REPORTS = int(os.getenv("FIRESTORE_MAX_REPORTS", "1000"))
+# Field path of the document id (what FieldPath.document_id() returns), for
+# ordering pages by id
+DOCUMENT_ID = "__name__"
+
+def issue_from_doc(doc_id, data):
+    """Normalizes one Firestore 'issues' document into the issue_obj shape."""
+    loc_data = data.get('location') or {}
+    geo_point = loc_data.get('geopoint')
+
+    issue_obj = {
+        "id": doc_id,
+        "location_name": loc_data.get('neighborhood', 'Unknown'),
+        "description": data.get('description', 'Issue reported'),
+        "category": data.get('category', 'general'),
+        "street": loc_data.get('streetName', ''),
+        "photo": data.get('photoUrl', ''),
+        "timestamp": data.get('createdAt', ''),
+        "source": "citizen_app"
+    }
+
+    if geo_point:
+        issue_obj["lat"] = geo_point.latitude
+        issue_obj["lng"] = geo_point.longitude
+        issue_obj["has_coords"] = True
+    else:
+        issue_obj["has_coords"] = False
+
+    return issue_obj
+
+# Live per-city index of reports, fed by a Firestore snapshot listener started
+# with the app. Until its first snapshot lands, reports are queried directly.
+CITIZEN_INDEX_ENABLED = os.getenv("CITIZEN_INDEX", "1") == "1"
+citizen_index = CitizenReportIndex(issue_from_doc, FIRESTORE_CITY_FIELD, FIRESTORE_CITY_RADIUS_KM)
+
+def start_citizen_index():
+    fields = list(ISSUE_FIELDS)
+    if FIRESTORE_CITY_FIELD and FIRESTORE_CITY_FIELD.split(".")[0] not in fields:
+        fields.append(FIRESTORE_CITY_FIELD)
+    try:
+        citizen_index.listen(get_db().collection('issues').select(fields))
+        logger.info("[INDEX] 👂 Listening for citizen report changes...")
+    except Exception as e:
+        logger.warning("[INDEX] ⚠️ Could not start listener, falling back to queries: %s", e)
+
+def city_bounding_box(center, radius_km=FIRESTORE_CITY_RADIUS_KM):
+    """(south, west, north, east) in degrees around a [lat, lng] centre."""
+    lat, lng = center
+    d_lat = radius_km / 111.0
+    d_lng = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+    return lat - d_lat, lng - d_lng, lat + d_lat, lng + d_lng
+
+def stream_pages(query, order_field, page_size=FIRESTORE_PAGE_SIZE, cap=FIRESTORE_MAX_REPORTS):
+    """Cursor-paginated stream of a query, stopping after `cap` documents."""
+    query = query.order_by(order_field).limit(page_size)
+    fetched = 0
+    last_doc = None
+    while fetched < cap:
+        page = query.start_after(last_doc) if last_doc else query
+        docs = list(page.stream())
+        for doc in docs[:cap - fetched]:
+            yield doc
+        fetched += len(docs)
+        if len(docs) < page_size:
+            break
+        last_doc = docs[-1]
+
+def fetch_real_firebase_issues(city: str, center=None):
+    logger.info("[DB] 📲 Fetching Citizen Reports for %s from Firebase...", city)
     
     issues_list = []
     try:
-        # Fetch all documents from 'issues' collection
-        docs = db.collection('issues').stream()
-        
-        count = 0
-        for doc in docs:
-            count += 1
-            data = doc.to_dict()
-            loc_data = data.get('location', {})
-            geo_point = loc_data.get('geopoint')
-            
-            # --- LOGGING POINT 1: Print every single report found ---
-            print(f"\n      📄 [Report #{count}] ID: {doc.id}")
-            print(f"          Category: {data.get('category')}")
-            print(f"          Description: {data.get('description')}")
-            print(f"          Location: {loc_data.get('neighborhood')} ({loc_data.get('streetName')})")
-            print(f"          Coords: {geo_point.latitude}, {geo_point.longitude}" if geo_point else "          Coords: ❌ None")
-
-            issue_obj = {
-                "id": doc.id,
-                "location_name": loc_data.get('neighborhood', 'Unknown'),
-                "description": data.get('description', 'Issue reported'),
-                "category": data.get('category', 'general'),
-                "street": loc_data.get('streetName', ''),
-                "photo": data.get('photoUrl', ''),
-                "timestamp": data.get('createdAt', ''),
-                "source": "citizen_app"
-            }
+        issues = get_db().collection('issues').select(ISSUE_FIELDS)
+
+        if FIRESTORE_CITY_FIELD:
+            city_query = issues.where(filter=firestore.FieldFilter(FIRESTORE_CITY_FIELD, "==", city))
+            docs = stream_pages(city_query, DOCUMENT_ID)
+            bbox = None
+        elif center:
+            # GeoPoints order by latitude first, so the range only bounds the
+            # latitude band; longitude is checked below
+            south, west, north, east = bbox = city_bounding_box(center)
+            geo_query = issues.where(
+                filter=firestore.FieldFilter("location.geopoint", ">=", firestore.GeoPoint(south, west))
+            ).where(
+                filter=firestore.FieldFilter("location.geopoint", "<=", firestore.GeoPoint(north, east))
+            )
+            # Text-only reports can't be placed in the box and are left out
+            docs = stream_pages(geo_query, "location.geopoint")
+        else:
+            logger.warning("[DB] ⚠️ No city field or centre to filter on, reading a capped page set.")
+            docs = stream_pages(issues, DOCUMENT_ID)
+            bbox = None
 
-            if geo_point:
-                issue_obj["lat"] = geo_point.latitude
-                issue_obj["lng"] = geo_point.longitude
-                issue_obj["has_coords"] = True
-            else:
-                issue_obj["has_coords"] = False
-            
-            issues_list.append(issue_obj)
+        with track_dependency("firestore", "issues"):
+            for doc in docs:
+                issue_obj = issue_from_doc(doc.id, doc.to_dict())
+                if bbox and issue_obj["has_coords"] and not (bbox[1] <= issue_obj["lng"] <= bbox[3]):
+                    continue
+                issues_list.append(issue_obj)
 
-        print(f"\n   [DB] ✅ Finished. Total Valid Reports: {len(issues_list)}")
+        logger.info("[DB] ✅ Finished. Total Valid Reports: %d", len(issues_list))
 
     except Exception as e:
-        print(f"   !!! Firebase Fetch Error: {e}")
+        logger.error("!!! Firebase Fetch Error: %s", e)
         return []
 
     return issues_list
 
+def latitude_bands(boxes):
+    """
+    Groups city boxes whose latitude ranges overlap, so each group can be read
+    with one narrow latitude range. Returns [(south, west, north, east, [city_key])].
+    """
+    bands = []
+    for city_key, (south, west, north, east) in sorted(boxes.items(), key=lambda item: item[1][0]):
+        if bands and south <= bands[-1][2]:
+            b_south, b_west, b_north, b_east, keys = bands[-1]
+            bands[-1] = (b_south, min(b_west, west), max(b_north, north), max(b_east, east), keys + [city_key])
+        else:
+            bands.append((south, west, north, east, [city_key]))
+    return bands
+
+def fetch_firebase_issues_for_cities(centers):
+    """
+    One Firestore pass for several cities. `centers` maps a city name to its
+    [lat, lng] centre (or None); returns {city_key: reports}, at most
+    FIRESTORE_MAX_REPORTS located reports per city.
+    """
+    partitions = {city.lower().strip(): [] for city in centers}
+    logger.info("[DB] 📲 Fetching Citizen Reports for %d cities in one pass...", len(partitions))
+
+    def full(city_keys):
+        return all(len(partitions[city_key]) >= FIRESTORE_MAX_REPORTS for city_key in city_keys)
+
+    try:
+        issues = get_db().collection('issues')
+
+        if FIRESTORE_CITY_FIELD:
+            fields = list(ISSUE_FIELDS)
+            if FIRESTORE_CITY_FIELD.split(".")[0] not in fields:
+                fields.append(FIRESTORE_CITY_FIELD)
+            names = list(centers)
+            with track_dependency("firestore", "issues"):
+                # Firestore caps "in" filters at 30 values
+                for i in range(0, len(names), 30):
+                    chunk = names[i:i + 30]
+                    city_query = issues.select(fields).where(
+                        filter=firestore.FieldFilter(FIRESTORE_CITY_FIELD, "in", chunk)
+                    )
+                    chunk_keys = [name.lower().strip() for name in chunk]
+                    docs = stream_pages(
+                        city_query, DOCUMENT_ID, cap=FIRESTORE_MAX_REPORTS * len(chunk)
+                    )
+                    for doc in docs:
+                        city_key = str(doc.get(FIRESTORE_CITY_FIELD) or "").lower().strip()
+                        if city_key in partitions and len(partitions[city_key]) < FIRESTORE_MAX_REPORTS:
+                            partitions[city_key].append(issue_from_doc(doc.id, doc.to_dict()))
+                        if full(chunk_keys):
+                            break
+        else:
+            boxes = {
+                city.lower().strip(): city_bounding_box(center)
+                for city, center in centers.items() if center
+            }
+            if not boxes:
+                return {}
+            issues = issues.select(ISSUE_FIELDS)
+            with track_dependency("firestore", "issues"):
+                # One latitude-range query per group of cities at overlapping
+                # latitudes (a far-apart city never eats a neighbour's budget);
+                # each report is then assigned to the boxes it falls in
+                for south, west, north, east, band_keys in latitude_bands(boxes):
+                    geo_query = issues.where(
+                        filter=firestore.FieldFilter("location.geopoint", ">=", firestore.GeoPoint(south, west))
+                    ).where(
+                        filter=firestore.FieldFilter("location.geopoint", "<=", firestore.GeoPoint(north, east))
+                    )
+                    docs = stream_pages(geo_query, "location.geopoint", cap=FIRESTORE_MAX_REPORTS * len(band_keys))
+                    for doc in docs:
+                        issue_obj = issue_from_doc(doc.id, doc.to_dict())
+                        for city_key in band_keys:
+                            s, w, n, e = boxes[city_key]
+                            if (s <= issue_obj["lat"] <= n and w <= issue_obj["lng"] <= e
+                                    and len(partitions[city_key]) < FIRESTORE_MAX_REPORTS):
+                                partitions[city_key].append(issue_obj)
+                        if full(band_keys):
+                            break
+            # Text-only reports can't be placed in a box and are left out
+            partitions = {city_key: partitions[city_key] for city_key in boxes}
+
+        logger.info("[DB] ✅ Finished. Reports per city: %s", {k: len(v) for k, v in partitions.items()})
+
+    except Exception as e:
+        # Cities without a partition fall back to their own query
+        logger.error("!!! Firebase Batch Fetch Error: %s", e)
+        return {}
+
+    return partitions
+
 # --- 3. MODELS & STATE ---
 
 class CityAnalysisRequest(BaseModel):
     city: str
+    # Skip the warm snapshot and run the pipeline now
+    force: bool = False
+    # data_version the client already has; only marker changes are returned
+    since_version: Optional[int] = None
+
+class CityBatchRequest(BaseModel):
+    cities: List[str]
 
 # ### NEW CHANGE: Simplified Chat Request ###
 # We don't ask the frontend for data anymore. Just the city and message.
@@ -325,8 +525,15 @@ class CityState(TypedDict):
     city_coords: List[float]
     raw_gov_data: Dict
     raw_citizen_reports: List[Dict]
+    category_counts: Dict
+    citizen_markers: List[Dict]
+    gov_markers: List[Dict]
     analyzed_locations: List[Dict]
     ai_summary: str
+    # Reports already read by a batch run, so the node skips its own query
+    prefetched_reports: Optional[List[Dict]]
+    # Queue priority for external calls (PRIORITY_BACKGROUND for refreshes)
+    priority: int
 
 # --- 4. AGENT NODES ---
 
@@ -337,71 +544,112 @@ class CityState(TypedDict):
 #         "raw_citizen_reports": fetch_real_firebase_issues(city)
 #     }
 
-def data_aggregator(state: CityState):
+# The aggregator is split into independent nodes so the slow sources run in
+# parallel: gov data alongside (city centre -> citizen reports), which needs
+# the centre for its geo filter.
+
+def city_locator(state: CityState):
     city = state["city"]
     
-    # 1. Get City Center immediately (Fallback to Mumbai if fails)
+    # Get City Center immediately (Fallback to Mumbai if fails)
     try:
-        loc = geolocator.geocode(city)
-        center = [loc.latitude, loc.longitude] if loc else [19.07, 72.87]
+        center = geocode(city, priority=state.get("priority", PRIORITY_INTERACTIVE)) or [19.07, 72.87]
     except:
         center = [19.07, 72.87]
 
+    return {"city_coords": center}
+
+def gov_fetcher(state: CityState):
+    return {"raw_gov_data": fetch_gov_api_data(state["city"])}
+
+def citizen_reports(state: CityState):
+    city = state["city"]
+    center = state["city_coords"]
+
+    # Straight from the live index when it's ready
+    city_key = city.lower().strip()
+    if citizen_index.ready:
+        citizen_index.track_city(city_key, center)
+        reports = citizen_index.reports(city_key)
+        counts = citizen_index.category_counts(city_key)
+    else:
+        reports = state.get("prefetched_reports")
+        if reports is None:
+            reports = fetch_real_firebase_issues(city, center)
+        counts = {}
+        # Keep /city-stats answering until the listener takes over; rollups
+        # are keyed by report id, so the listener won't double count these
+        for report in reports:
+            citizen_index.rollups.add(report["id"], city_key, report["category"], report["timestamp"])
+
     return {
-        "city_coords": center, # <--- Pass this to state
-        "raw_gov_data": fetch_gov_api_data(city),
-        "raw_citizen_reports": fetch_real_firebase_issues(city)
+        "raw_citizen_reports": reports,
+        "category_counts": counts
     }
 
 def city_analyst(state: CityState):
-    """Node 2: AI Analysis + Govt Data Integration."""
+    """Node 2: AI Analysis of Citizen Reports."""
     firebase_reports = state['raw_citizen_reports']
-    gov_data = state['raw_gov_data']
     city_name = state['city']
     
-    # --- STEP 1: Ask AI to process Citizen Reports ---
-    prompt = f"""
-    City: {city_name}
-    Citizen Reports: {str(firebase_reports)[:2000]} 
-    
-    TASK: Return a JSON Array of map markers based ONLY on the citizen reports.
-    - Use specific location names found in the reports.
-    - Determine sentiment (negative/positive).
-    
-    JSON ONLY.
-    """
-    
+    # --- STEP 0: Merge duplicate / near-duplicate reports ---
+    # Ten reports about the same pothole become one weighted marker, so both
+    # the LLM and the cartographer see fewer inputs (see spatial.py)
+    consolidated = consolidate_reports(firebase_reports)
     final_list = []
     
+    # 1. Add Real Citizen Reports (Prioritize Lat/Lng from App)
+    for report in consolidated:
+        if report.get('has_coords'):
+            final_list.append({
+                "location_name": report['location_name'],
+                "lat": report['lat'],
+                "lng": report['lng'],
+                "category": report['category'],
+                "description": report['description'],
+                "sentiment": "negative", # Reports are usually issues
+                "is_real_report": True,
+                "report_count": report['report_count']
+            })
+    
+    # --- STEP 1: Ask AI to process Citizen Reports ---
+    # Only text-only reports need the AI to infer a location; they are sent
+    # in token-budgeted batches and memoized per report (see extraction.py)
     try:
         parser = JsonOutputParser()
-        chain = llm | parser
-        ai_response = chain.invoke([HumanMessage(content=prompt)])
-        
-        # 1. Add Real Citizen Reports (Prioritize Lat/Lng from App)
-        for report in firebase_reports:
-            if report.get('has_coords'):
-                final_list.append({
-                    "location_name": report['location_name'],
-                    "lat": report['lat'],
-                    "lng": report['lng'],
-                    "category": report['category'],
-                    "description": report['description'],
-                    "sentiment": "negative", # Reports are usually issues
-                    "is_real_report": True
-                })
+        # Every extraction call queues for admission behind interactive chats
+        llm_priority = (
+            llm_admission.PRIORITY_BACKGROUND if state.get("priority", PRIORITY_INTERACTIVE) >= PRIORITY_BACKGROUND
+            else llm_admission.PRIORITY_ANALYSIS
+        )
+        chain = admission.gate(get_llm() | parser, llm_priority)
+        text_only = [r for r in consolidated if not r.get('has_coords')]
+        counts = {str(r.get('id', '')): r['report_count'] for r in text_only}
+        ai_response = extract_markers(chain, city_name, text_only)
         
         # 2. Add AI Inferred Locations (from text-only reports)
         if isinstance(ai_response, list):
+            seen_names = {r['location_name'] for r in final_list}
             for item in ai_response:
                 # Avoid duplicates if we already added the real report
-                if not any(r['location_name'] == item.get('location_name') for r in final_list):
-                    final_list.append(item)
+                if item.get('location_name') in seen_names:
+                    continue
+                seen_names.add(item.get('location_name'))
+                item.setdefault("report_count", counts.get(str(item.get("report_id", "")), 1))
+                final_list.append(item)
 
     except Exception as e:
-        print(f"AI Error: {e}")
+        logger.error("AI Error: %s", e)
 
-    # --- STEP 2: Manually Add Government Data Markers ---
+    return {"citizen_markers": final_list}
+
+def gov_marker_builder(state: CityState):
+    """Node 2b: Government Data Markers (runs in parallel with the LLM call)."""
+    gov_data = state['raw_gov_data']
+    city_name = state['city']
+    final_list = []
+
+    # --- Manually Add Government Data Markers ---
     # We create markers for these so the Cartographer node will geocode them
     
     # A. AQI Marker
@@ -462,75 +710,383 @@ def city_analyst(state: CityState):
             "is_gov_data": True
         })
 
-    return {"analyzed_locations": final_list}
+    return {"gov_markers": final_list}
 
-    
 
+# Geocoded markers are pushed to streaming clients in batches of this size
+CARTO_STREAM_BATCH = int(os.getenv("CARTO_STREAM_BATCH", "5"))
 
+# Markers are geocoded concurrently, at most CARTO_CONCURRENCY at a time
+CARTO_CONCURRENCY = int(os.getenv("CARTO_CONCURRENCY", "4"))
+carto_executor = ThreadPoolExecutor(max_workers=CARTO_CONCURRENCY, thread_name_prefix="carto")
+
+def place_marker(item, city, city_center, priority=PRIORITY_INTERACTIVE):
+    """Geocodes one marker in place, falling back to a jittered city centre."""
+    try:
+        query = f"{item['location_name']}, {city}"
+        
+        # Cached lookups are instant; misses wait for the shared,
+        # rate-limited geocoding queue (see geocoding.py)
+        coords = geocode(query, timeout=2, priority=priority)
+        
+        if coords:
+            item['lat'], item['lng'] = coords
+        else:
+            raise Exception("Location not found")
+
+    except Exception as e:
+        logger.info("[GEO FALLBACK] Could not find '%s'. Using City Center.", item['location_name'])
+        
+        # Use City Center
+        base_lat, base_lng = city_center
+        
+        # Add slight random offset so markers don't stack perfectly on top of each other
+        # 0.005 is roughly 500 meters
+        offset_lat = (random.random() - 0.5) * 0.01 
+        offset_lng = (random.random() - 0.5) * 0.01
+        
+        item['lat'] = base_lat + offset_lat
+        item['lng'] = base_lng + offset_lng
+        item['location_name'] = f"{item['location_name']} (Approx)"
+
+    return item
 
 def cartographer(state: CityState):
-    final_markers = []
     city_center = state.get("city_coords", [19.07, 72.87])
+    # No-op unless the graph is run with stream_mode="custom"
+    write = get_stream_writer()
 
-    for item in state['analyzed_locations']:
-        # Case 1: Already has coordinates (Citizen App Data)
-        if item.get("lat") and item.get("lng"):
-            final_markers.append(item)
-            continue
+    items = state.get('citizen_markers', []) + state.get('gov_markers', [])
 
-        # Case 2: Needs Geocoding (Gov Data)
-        try:
-            # Add a small delay to be nice to the free API
-            time.sleep(0.5) 
-            query = f"{item['location_name']}, {state['city']}"
-            
-            print(f"   [GEO] Looking up: {query}")
-            loc = geolocator.geocode(query, timeout=2)
-            
-            if loc:
-                item['lat'] = loc.latitude
-                item['lng'] = loc.longitude
-            else:
-                raise Exception("Location not found")
+    # Case 1: Already has coordinates (Citizen App Data)
+    # Case 2: Needs Geocoding (AI-inferred and Gov Data)
+    to_geocode = [item for item in items if not (item.get("lat") and item.get("lng"))]
 
-        except Exception as e:
-            print(f"   [GEO FALLBACK] Could not find '{item['location_name']}'. Using City Center.")
-            
-            # Use City Center
-            base_lat, base_lng = city_center
-            
-            # Add slight random offset so markers don't stack perfectly on top of each other
-            # 0.005 is roughly 500 meters
-            offset_lat = (random.random() - 0.5) * 0.01 
-            offset_lng = (random.random() - 0.5) * 0.01
-            
-            item['lat'] = base_lat + offset_lat
-            item['lng'] = base_lng + offset_lng
-            item['location_name'] = f"{item['location_name']} (Approx)"
-
-        # Always append the marker, even if we used the fallback
-        final_markers.append(item)
-            
-    return {"analyzed_locations": final_markers}
+    priority = state.get("priority", PRIORITY_INTERACTIVE)
+    futures = [
+        carto_executor.submit(place_marker, item, state['city'], city_center, priority) for item in to_geocode
+    ]
+    pending_batch = []
+    for future in as_completed(futures):
+        # Always keep the marker, even if we used the fallback
+        pending_batch.append(future.result())
+        if len(pending_batch) >= CARTO_STREAM_BATCH:
+            write({"geocoded_markers": pending_batch})
+            pending_batch = []
+
+    if pending_batch:
+        write({"geocoded_markers": pending_batch})
+
+    # Markers are updated in place, so the original order is kept
+    return {"analyzed_locations": items}
 
 
 # --- 5. WORKFLOW SETUP ---
 
+#   START -> locator -> citizen_reports -> analyst ----\
+#   START -> gov_fetcher -> gov_markers ----------------+-> cartographer -> END
+# Every node is timed into citybrain_node_seconds{node=...}
 workflow = StateGraph(CityState)
-workflow.add_node("aggregator", data_aggregator)
-workflow.add_node("analyst", city_analyst)
-workflow.add_node("cartographer", cartographer)
+workflow.add_node("locator", instrument_node("locator", city_locator))
+workflow.add_node("gov_fetcher", instrument_node("gov_fetcher", gov_fetcher))
+workflow.add_node("citizen_reports", instrument_node("citizen_reports", citizen_reports))
+workflow.add_node("analyst", instrument_node("analyst", city_analyst))
+workflow.add_node("gov_markers", instrument_node("gov_markers", gov_marker_builder))
+workflow.add_node("cartographer", instrument_node("cartographer", cartographer))
+
+workflow.add_edge(START, "locator")
+workflow.add_edge(START, "gov_fetcher")
+
+workflow.add_edge("locator", "citizen_reports")
+workflow.add_edge("citizen_reports", "analyst")
+workflow.add_edge("gov_fetcher", "gov_markers")
+# Waits for both branches
+workflow.add_edge(["analyst", "gov_markers"], "cartographer")
+workflow.add_edge("cartographer", END)
+app_brain = None
+
+def get_app_brain():
+    """Compiled workflow, built on first use."""
+    global app_brain
+    if app_brain is None:
+        app_brain = workflow.compile()
+    return app_brain
+
+# Graph runs happen off the event loop on this pool; ANALYSIS_WORKERS caps how
+# many different cities are analyzed at once.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+analysis_flights = SingleFlight()
+
+def new_city_state(city: str, priority=PRIORITY_INTERACTIVE):
+    return {
+        "city": city,
+        "raw_gov_data": {},
+        "raw_citizen_reports": [],
+        "category_counts": {},
+        "citizen_markers": [],
+        "gov_markers": [],
+        "analyzed_locations": [],
+        "ai_summary": "",
+        "prefetched_reports": None,
+        "priority": priority
+    }
 
-workflow.set_entry_point("aggregator")
+def category_breakdown(result):
+    """Precomputed when reports came from the index, counted otherwise."""
+    category_stats = result.get("category_counts")
+    if not category_stats:
+        categories = [r['category'] for r in result['raw_citizen_reports']]
+        category_stats = dict(Counter(categories))
+    return category_stats
 
-workflow.add_edge("aggregator", "analyst")
-workflow.add_edge("analyst", "cartographer")
-workflow.add_edge("cartographer", END)
-app_brain = workflow.compile()
+def finalize_analysis(city: str, result):
+    """Caches a finished graph state for chat and builds the dashboard payload."""
+    # 2. Process Stats for Dashboard
+    category_stats = category_breakdown(result)
+
+    # ### NEW CHANGE: STORE DATA IN SERVER MEMORY ###
+    # We save this data so the chatbot can access it later.
+    city_key = city.lower().strip()
+    citizen_stats = {
+        "total": len(result["raw_citizen_reports"]),
+        "breakdown": category_stats
+    }
+    # Stable ids let clients apply marker deltas
+    assign_marker_ids(result["analyzed_locations"])
+    stored = CITY_DATA_STORE.put(city_key, {
+        "gov_data": result["raw_gov_data"],
+        "citizen_stats": citizen_stats,
+        "markers": result["analyzed_locations"],
+        # Center already geocoded by the locator node
+        "city_center": result["city_coords"],
+        "recent_issues": result["raw_citizen_reports"][:5],
+        # Built once here so /chat just splices it in
+        "chat_context": build_chat_context(result["raw_gov_data"], citizen_stats, result["raw_citizen_reports"])
+    })
+    logger.info("✅ Data for %s cached (version %s).", city_key, stored['version'])
+    # Answers about the previous snapshot are stale now
+    chat_cache.invalidate_where(lambda key: key[0] == city_key)
+    marker_history.set((city_key, stored["version"]), stored["markers"])
+
+    return snapshot_payload(stored)
+
+def snapshot_payload(stored):
+    """Dashboard payload for a CITY_DATA_STORE entry."""
+    return {
+        "city": stored["city_center"],
+        "city_center": stored["city_center"],
+        "map_markers": stored["markers"],
+        "gov_data": stored["gov_data"],
+        "citizen_stats": {
+            "total_reports": stored["citizen_stats"]["total"],
+            "category_breakdown": stored["citizen_stats"]["breakdown"]
+        },
+        "recent_issues": stored["recent_issues"],
+        "data_version": stored["version"],
+        "updated_at": stored["updated_at"]
+    }
+
+def run_city_analysis(city: str, reports=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Runs the workflow for one city and returns the dashboard payload.
+    `reports` are citizen reports already fetched by a batch run.
+    """
+    initial_state = new_city_state(city, priority)
+    initial_state["prefetched_reports"] = reports
+    
+    # 1. Run the LangGraph Workflow
+    result = get_app_brain().invoke(initial_state)
+    return finalize_analysis(city, result)
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(payload))}\n\n"
+
+def stream_city_analysis(city: str, emit):
+    """
+    Runs the workflow with LangGraph streaming and calls `emit(event, payload)`
+    as each node lands: city centre, gov data and citizen stats (in whichever
+    order the parallel branches finish), then markers that already have
+    coordinates, then geocoded markers in batches. Returns the full payload,
+    like run_city_analysis.
+    """
+    state = new_city_state(city)
+
+    for mode, chunk in get_app_brain().stream(state, stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            emit("markers", {"markers": chunk["geocoded_markers"], "stage": "geocoded"})
+            continue
+
+        for node, update in chunk.items():
+            state.update(update or {})
+            if node == "locator":
+                emit("city_center", {"city_center": state["city_coords"]})
+            elif node == "gov_fetcher":
+                emit("gov_data", {"gov_data": state["raw_gov_data"]})
+            elif node == "citizen_reports":
+                emit("citizen_stats", {
+                    "citizen_stats": {
+                        "total_reports": len(state["raw_citizen_reports"]),
+                        "category_breakdown": category_breakdown(state)
+                    },
+                    "recent_issues": state["raw_citizen_reports"][:5]
+                })
+            elif node == "analyst":
+                located = [m for m in state["citizen_markers"] if m.get("lat") and m.get("lng")]
+                emit("markers", {"markers": located, "stage": "citizen"})
+
+    return finalize_analysis(city, state)
+
+# Chat replies are cached per (city, normalized message, city data version),
+# so a refreshed analysis naturally stops matching older answers
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1024"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "1800"))
+chat_cache = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL, name="chat")
+watch_cache(chat_cache)
+REGISTRY.gauge(
+    "citybrain_city_store", "Entries and approximate bytes held by CITY_DATA_STORE.", ("measure",),
+    lambda: {("entries",): CITY_DATA_STORE.stats()["entries"], ("bytes",): CITY_DATA_STORE.stats()["bytes"]},
+)
+
+def chat_cache_key(city_key: str, message: str, version: int):
+    normalized = " ".join(message.lower().split()).rstrip("?!. ")
+    return city_key, normalized, version
+
+# Spatial index over each analyzed city's markers, keyed by (city, data
+# version) so a refreshed analysis gets a fresh index
+marker_indexes = TTLCache(maxsize=64, ttl=6 * 3600, name="marker_index")
+
+def get_marker_index(city_key: str):
+    """Returns `(stored_entry, MarkerGrid)` for an analyzed city, or `(None, None)`."""
+    stored = CITY_DATA_STORE.get(city_key)
+    if not stored:
+        return None, None
+    key = (city_key, stored["version"])
+    grid = marker_indexes.get(key)
+    if grid is None:
+        grid = MarkerGrid(stored["markers"])
+        marker_indexes.set(key, grid)
+    return stored, grid
+
+# Markers of recent versions per city, the base for delta responses
+MARKER_HISTORY_SIZE = int(os.getenv("MARKER_HISTORY_SIZE", "256"))
+marker_history = TTLCache(maxsize=MARKER_HISTORY_SIZE, ttl=6 * 3600, name="marker_history")
+
+def analysis_response(city_key: str, payload, http_request: Request, since_version=None):
+    """
+    304 when the client's ETag matches, a marker delta when it sent a
+    version we still have, otherwise the full payload; compactly encoded.
+    """
+    version = payload["data_version"]
+    etag = payload_etag(city_key, version, payload["updated_at"])
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    markers = payload["map_markers"]
+    if marker_history.get((city_key, version)) is None:
+        marker_history.set((city_key, version), markers)
+    base = marker_history.get((city_key, since_version)) if since_version else None
+    if base is not None:
+        added, changed, removed = diff_markers(base, markers)
+        payload = {key: value for key, value in payload.items() if key != "map_markers"}
+        payload.update({
+            "delta": True,
+            "base_version": since_version,
+            "markers_added": added,
+            "markers_changed": changed,
+            "markers_removed": removed,
+        })
+    return encode_response(
+        payload,
+        accept=http_request.headers.get("accept", ""),
+        accept_encoding=http_request.headers.get("accept-encoding", ""),
+        headers=headers,
+    )
+
+# Popular cities are re-analyzed in the background (see refresh.py) on their
+# own small pool, so refreshes never take an interactive analysis worker.
+# /analyze-city serves snapshots up to ANALYSIS_MAX_AGE seconds old.
+REFRESH_SCHEDULER = os.getenv("REFRESH_SCHEDULER", "1") == "1"
+# Also keep the known cities warm before anyone asks for them (costs external
+# calls on an idle server, so opt-in)
+REFRESH_SEED_KNOWN = os.getenv("REFRESH_SEED_KNOWN", "0") == "1"
+ANALYSIS_MAX_AGE = float(os.getenv("ANALYSIS_MAX_AGE", "3600"))
+refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_CONCURRENCY, thread_name_prefix="refresh")
+
+def snapshot_age(city_key: str):
+    stored = CITY_DATA_STORE.get(city_key)
+    return time.time() - stored["updated_at"] if stored else None
+
+async def refresh_city(city: str):
+    city_key = city.lower().strip()
+    loop = asyncio.get_running_loop()
+    # Joins an interactive run for the city if there is one. Background runs
+    # use their own flight key so interactive requests never wait behind one
+    # at background priority.
+    if analysis_flights.is_running(city_key):
+        await analysis_flights.do(city_key, None)
+        return
+    await analysis_flights.do(
+        ("refresh", city_key),
+        lambda: loop.run_in_executor(refresh_executor, run_city_analysis, city, None, PRIORITY_BACKGROUND)
+    )
+
+# Bulk copies of the OGD resources that city lookups query locally (see ogd_store.py)
+ogd_ingester = Ingester()
+
+refresh_scheduler = RefreshScheduler(
+    refresh_city, snapshot_age,
+    seeds=[city for city in CITY_STATES if city not in CITY_ALIASES] if REFRESH_SEED_KNOWN else ()
+)
+REGISTRY.gauge(
+    "citybrain_refresh", "Cities tracked and refreshes running, done and failed in the background.", ("measure",),
+    lambda: {(measure,): value for measure, value in refresh_scheduler.stats().items()},
+)
 
 # --- 6. ENDPOINTS ---
 
-app = FastAPI()
+STARTUP_SECONDS = {}
+REGISTRY.gauge(
+    "citybrain_startup_seconds", "Seconds spent importing main.py and in the startup hook.", ("phase",),
+    lambda: {(phase,): seconds for phase, seconds in STARTUP_SECONDS.items()},
+)
+
+def warm_up():
+    """Builds every lazy client up front so the first request doesn't pay for it."""
+    get_app_brain()
+    get_llm()
+    get_db()
+    ogd_client.get_session()
+    geocoding.get_cache()
+    geocoding.get_service()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # Cities analyzed before the restart are served straight from disk
+    restored = CITY_DATA_STORE.load_snapshots()
+    if restored:
+        logger.info("[STORE] 💾 Restored %d city snapshots.", restored)
+    if WARMUP:
+        await asyncio.get_running_loop().run_in_executor(None, warm_up)
+    if CITIZEN_INDEX_ENABLED:
+        start_citizen_index()
+    if REFRESH_SCHEDULER:
+        refresh_scheduler.start()
+    if ogd_store.OGD_INGEST:
+        ogd_ingester.start()
+    STARTUP_SECONDS["startup"] = time.perf_counter() - started
+    logger.info(
+        "🚀 Ready (import %.2fs, startup %.2fs%s)",
+        STARTUP_SECONDS["import"], STARTUP_SECONDS["startup"], ", warmed up" if WARMUP else ""
+    )
+    yield
+    refresh_scheduler.stop()
+    ogd_ingester.stop()
+    citizen_index.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -540,57 +1096,232 @@ app.add_middleware(
 )
 
 @app.post("/analyze-city")
-async def analyze_city_endpoint(request: CityAnalysisRequest):
-    print(f"\n=== 🧠 REQUEST: Analyze {request.city} ===")
+async def analyze_city_endpoint(request: CityAnalysisRequest, http_request: Request):
+    logger.info("=== 🧠 REQUEST: Analyze %s ===", request.city)
+
+    # Warm snapshot (kept fresh by the refresh scheduler) unless forced
+    city_key = request.city.lower().strip()
+    if not request.force:
+        stored = CITY_DATA_STORE.get(city_key)
+        # Entries written before snapshots carried a centre can't be served
+        if stored and "city_center" in stored and time.time() - stored["updated_at"] <= ANALYSIS_MAX_AGE:
+            refresh_scheduler.record(request.city)
+            return analysis_response(city_key, snapshot_payload(stored), http_request, request.since_version)
+
+    # The graph is synchronous, so it runs on the bounded analysis pool to keep
+    # the event loop (and /chat) responsive. Concurrent requests for the same
+    # city share one run.
+    loop = asyncio.get_running_loop()
+    payload = await analysis_flights.do(
+        city_key, lambda: loop.run_in_executor(analysis_executor, run_city_analysis, request.city)
+    )
+    # Only cities that could be analyzed count towards background refresh
+    refresh_scheduler.record(request.city)
+    return analysis_response(city_key, payload, http_request, request.since_version)
+
+# Upper bound on cities per /analyze-cities call
+MAX_BATCH_CITIES = int(os.getenv("MAX_BATCH_CITIES", "20"))
+
+@app.post("/analyze-cities")
+async def analyze_cities_endpoint(request: CityBatchRequest):
+    """
+    Analyzes several cities in one call. Citizen reports are read from
+    Firestore in a single pass and partitioned per city, OGD fetches shared
+    between cities (e.g. one power fetch per state) are deduplicated by the
+    OGD client, and the per-city graphs run on the bounded analysis pool.
+    """
+    cities = list({city.lower().strip(): city.strip() for city in request.cities if city.strip()}.values())
+    if not cities:
+        raise HTTPException(status_code=400, detail="No cities given")
+    if len(cities) > MAX_BATCH_CITIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_CITIES} cities per batch")
+    logger.info("=== 🧠 BATCH REQUEST: Analyze %s ===", ", ".join(cities))
+
+    loop = asyncio.get_running_loop()
+    partitions = {}
+    # The live index already holds every city's reports
+    if not citizen_index.ready:
+        if FIRESTORE_CITY_FIELD:
+            centers = dict.fromkeys(cities)
+        else:
+            found = await asyncio.gather(*(ageocode(city) for city in cities), return_exceptions=True)
+            centers = {
+                city: center for city, center in zip(cities, found)
+                if center and not isinstance(center, Exception)
+            }
+        if centers:
+            partitions = await loop.run_in_executor(None, fetch_firebase_issues_for_cities, centers)
+
+    def analyze(city):
+        reports = partitions.get(city.lower().strip())
+        return analysis_flights.do(
+            city.lower().strip(),
+            lambda: loop.run_in_executor(analysis_executor, run_city_analysis, city, reports)
+        )
+
+    outcomes = await asyncio.gather(*(analyze(city) for city in cities), return_exceptions=True)
+    results, errors = {}, {}
+    for city, outcome in zip(cities, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error("Batch analysis failed for %s: %s", city, outcome)
+            errors[city] = str(outcome)
+        else:
+            results[city] = outcome
+    return {"results": results, "errors": errors}
+
+@app.get("/analyze-city/stream")
+async def analyze_city_stream_endpoint(city: str, force: bool = False):
+    """
+    Streaming variant of /analyze-city (GET so the browser's EventSource can
+    use it). A fresh snapshot is sent straight away as the `done` event.
+    Otherwise the graph runs on the bounded analysis pool and its events are
+    relayed through a queue; a request joining a run already in flight for
+    the city only gets the final payload.
+    """
+    logger.info("=== 🧠 STREAM REQUEST: Analyze %s ===", city)
+    city_key = city.lower().strip()
+
+    async def events():
+        stored = None if force else CITY_DATA_STORE.get(city_key)
+        if stored and "city_center" in stored and time.time() - stored["updated_at"] <= ANALYSIS_MAX_AGE:
+            refresh_scheduler.record(city)
+            yield sse_event("done", snapshot_payload(stored))
+            return
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def emit(event, payload):
+            # Encoded on the worker thread, handed to the loop in order
+            loop.call_soon_threadsafe(queue.put_nowait, sse_event(event, payload))
+
+        # Joins the city's run if one is already in flight (emit is unused then)
+        run = asyncio.ensure_future(analysis_flights.do(
+            city_key, lambda: loop.run_in_executor(analysis_executor, stream_city_analysis, city, emit)
+        ))
+        run.add_done_callback(lambda _: queue.put_nowait(None))
+
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+        try:
+            payload = run.result()
+        except Exception as e:
+            logger.error("!!! Stream Error for %s: %s", city, e)
+            yield sse_event("error", {"detail": str(e)})
+            return
+        refresh_scheduler.record(city)
+        yield sse_event("done", payload)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def build_chat_prompt(city: str, message: str, stored_data):
+    # Construct the prompt using the STORED Govt & App Data (precomputed,
+    # compact context block; rebuilt only for entries stored without one)
+    context = stored_data.get('chat_context') or build_chat_context(
+        stored_data['gov_data'], stored_data['citizen_stats']
+    )
+
+    return f"""
+    You are the 'City Brain' AI Assistant for {city}.
     
-    initial_state = {
-        "city": request.city,
-        "raw_gov_data": {},
-        "raw_citizen_reports": [],
-        "analyzed_locations": [],
-        "ai_summary": ""
-    }
+{context['text']}
     
-    # 1. Run the LangGraph Workflow
-    result = app_brain.invoke(initial_state)
+    --- USER QUESTION ---
+    "{message}"
     
-    # 2. Process Stats for Dashboard
-    categories = [r['category'] for r in result['raw_citizen_reports']]
-    category_stats = dict(Counter(categories))
+    --- INSTRUCTIONS ---
+    1. Answer the question using ONLY the data above.
+    2. If the user asks about Air Quality (AQI), use the exact number from the sensor data.
+    3. If the user asks about problems, cite the citizen report statistics.
+    4. Keep it helpful, professional, and concise.
+    """
 
-    # ### NEW CHANGE: STORE DATA IN SERVER MEMORY ###
-    # We save this data so the chatbot can access it later.
-    city_key = request.city.lower().strip()
-    CITY_DATA_STORE[city_key] = {
-        "gov_data": result["raw_gov_data"],
-        "citizen_stats": {
-            "total": len(result["raw_citizen_reports"]),
-            "breakdown": category_stats
-        },
-        "markers": result["analyzed_locations"]
+def busy_reply(retry_after):
+    return f"I'm handling a lot of questions right now. Please try again in {retry_after} seconds."
+
+def chunk_text(chunk):
+    """Text of a streamed message chunk (content may be a string or a list of parts)."""
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in chunk.content)
+
+@app.get("/map-markers")
+def map_markers_endpoint(city: str, south: float, west: float, north: float, east: float, zoom: int = 12):
+    """
+    Markers of an analyzed city inside a viewport, clustered server-side for
+    the zoom level: single markers come back as-is, denser cells as one
+    cluster with counts.
+    """
+    city_key = city.lower().strip()
+    stored, grid = get_marker_index(city_key)
+    if grid is None:
+        raise HTTPException(status_code=404, detail=f"{city} has not been analyzed yet.")
+
+    markers, clusters = grid.clusters(south, west, north, east, zoom)
+    return {
+        "city": city,
+        "data_version": stored["version"],
+        "zoom": zoom,
+        "total_markers": grid.size,
+        "markers": markers,
+        "clusters": clusters
     }
-    print(f"   ✅ Data for {city_key} cached in memory.")
 
-    # 3. Get Center
-    try:
-        loc = geolocator.geocode(request.city)
-        center = [loc.latitude, loc.longitude] if loc else [19.07, 72.87]
-    except:
-        center = [19.07, 72.87]
+STATS_WINDOWS = {"24h": 24, "7d": 7 * 24, "30d": 30 * 24}
+
+@app.get("/city-stats")
+def city_stats_endpoint(city: str, window: str = "7d"):
+    """
+    Citizen report counts per category for the last 24h/7d/30d, with the
+    change against the previous window of the same length and a daily
+    series, all read from the incremental rollups.
+    """
+    hours = STATS_WINDOWS.get(window)
+    if hours is None:
+        raise HTTPException(status_code=400, detail=f"window must be one of {', '.join(STATS_WINDOWS)}")
+
+    city_key = city.lower().strip()
+    rollups = citizen_index.rollups
+    scope = [city_key]
+    now = datetime.now(timezone.utc)
+
+    current = rollups.window(scope, hours, end=now)
+    previous = rollups.window(scope, hours, end=now - timedelta(hours=hours))
+
+    trend = {}
+    for category in set(current) | set(previous):
+        before, after = previous.get(category, 0), current.get(category, 0)
+        trend[category] = {
+            "current": after,
+            "previous": before,
+            "change_pct": round((after - before) / before * 100, 1) if before else None
+        }
 
-    # 4. Return structure for React Dashboard
     return {
-        "city": result["city_coords"],
-        "city_center": center,
-        "map_markers": result["analyzed_locations"],
-        "gov_data": result["raw_gov_data"],
-        "citizen_stats": {
-            "total_reports": len(result["raw_citizen_reports"]),
-            "category_breakdown": category_stats
-        },
-        "recent_issues": result["raw_citizen_reports"][:5]
+        "city": city,
+        "window": window,
+        "total": sum(current.values()),
+        "previous_total": sum(previous.values()),
+        "by_category": dict(current),
+        "trend": trend,
+        "daily": [
+            {"date": day.isoformat(), "total": total}
+            for day, total in rollups.daily_series(scope, max(1, hours // 24), end=now)
+        ]
     }
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text format: node and dependency latencies, errors, cache stats."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/chat")
 async def chat_endpoint(request: ChatRequest):
     # ### NEW CHANGE: RETRIEVE FROM SERVER MEMORY ###
@@ -604,38 +1335,99 @@ async def chat_endpoint(request: ChatRequest):
             "reply": f"I don't have the data for {request.city} loaded yet. Please click 'Analyze City' on the dashboard first."
         }
 
-    # Construct the prompt using the STORED Govt & App Data
-    gov_context = stored_data['gov_data']
-    stats_context = stored_data['citizen_stats']
+    cache_key = chat_cache_key(city_key, request.message, stored_data["version"])
+    cached_reply = chat_cache.get(cache_key)
+    if cached_reply is not None:
+        logger.info("💬 Chat Query for %s (Cached Reply)", city_key)
+        return {"reply": cached_reply}
 
-    print(f"   💬 Chat Query for {city_key} (Using Cached Data)")
+    logger.info("💬 Chat Query for %s (Using Cached Data)", city_key)
 
-    prompt = f"""
-    You are the 'City Brain' AI Assistant for {request.city}.
-    
-    --- REAL-TIME GOVT SENSOR DATA ---
-    {json.dumps(gov_context, indent=2)}
-    
-    --- CITIZEN ISSUE REPORT STATS ---
-    Total Reports: {stats_context['total']}
-    Breakdown: {json.dumps(stats_context['breakdown'], indent=2)}
-    
-    --- USER QUESTION ---
-    "{request.message}"
-    
-    --- INSTRUCTIONS ---
-    1. Answer the question using ONLY the data above.
-    2. If the user asks about Air Quality (AQI), use the exact number from the sensor data.
-    3. If the user asks about problems, cite the citizen report statistics.
-    4. Keep it helpful, professional, and concise.
-    """
+    prompt = build_chat_prompt(request.city, request.message, stored_data)
     
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
+        async with admission.aslot(llm_admission.PRIORITY_CHAT, estimate_tokens(prompt) + LLM_OUTPUT_TOKENS):
+            with track_dependency("gemini", "chat"):
+                response = await get_llm().ainvoke([HumanMessage(content=prompt)])
+        chat_cache.set(cache_key, response.content)
         return {"reply": response.content}
+    except LLMOverloaded as e:
+        logger.warning("Chat shed for %s, retry after %ss", city_key, e.retry_after)
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"reply": busy_reply(e.retry_after), "retry_after": e.retry_after}
+        )
     except Exception as e:
-        print(f"Chat Error: {e}")
+        logger.error("Chat Error: %s", e)
         return {"reply": "I'm having trouble processing that request right now."}
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Streaming variant of /chat: Server-Sent Events with one 'token' event per
+    chunk as Gemini generates it, then 'done' with the full reply.
+    """
+    city_key = request.city.lower().strip()
+    stored_data = CITY_DATA_STORE.get(city_key)
+
+    async def events():
+        if not stored_data:
+            reply = f"I don't have the data for {request.city} loaded yet. Please click 'Analyze City' on the dashboard first."
+            yield sse_event("done", {"reply": reply})
+            return
+
+        cache_key = chat_cache_key(city_key, request.message, stored_data["version"])
+        cached_reply = chat_cache.get(cache_key)
+        if cached_reply is not None:
+            yield sse_event("token", {"text": cached_reply})
+            yield sse_event("done", {"reply": cached_reply, "cached": True})
+            return
+
+        logger.info("💬 Streaming Chat Query for %s (Using Cached Data)", city_key)
+        prompt = build_chat_prompt(request.city, request.message, stored_data)
+        chunks = asyncio.Queue()
+
+        async def generate():
+            # Chunks are buffered in the queue, so the admission slot is
+            # released when Gemini finishes, not when a slow client has read them
+            async with admission.aslot(llm_admission.PRIORITY_CHAT, estimate_tokens(prompt) + LLM_OUTPUT_TOKENS):
+                with track_dependency("gemini", "chat_stream"):
+                    async for chunk in get_llm().astream([HumanMessage(content=prompt)]):
+                        text = chunk_text(chunk)
+                        if text:
+                            chunks.put_nowait(text)
+
+        producer = asyncio.ensure_future(generate())
+        producer.add_done_callback(lambda _: chunks.put_nowait(None))
+        parts = []
+        try:
+            while True:
+                text = await chunks.get()
+                if text is None:
+                    break
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+            producer.result()
+        except LLMOverloaded as e:
+            logger.warning("Chat shed for %s, retry after %ss", city_key, e.retry_after)
+            yield sse_event("error", {"reply": busy_reply(e.retry_after), "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            logger.error("Chat Error: %s", e)
+            yield sse_event("error", {"reply": "I'm having trouble processing that request right now."})
+            return
+        finally:
+            # Client went away: stop generating for nobody
+            producer.cancel()
+
+        reply = "".join(parts)
+        chat_cache.set(cache_key, reply)
+        yield sse_event("done", {"reply": reply})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+STARTUP_SECONDS["import"] = time.perf_counter() - IMPORT_STARTED
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Minimal Prometheus-style metrics (counters, histograms and callback gauges)
+rendered in the text exposition format for the /metrics endpoint.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+# Seconds; covers a cache hit through a slow LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state):
+                    out.append((f"{self.name}_bucket", _labels(self.labelnames, key, [("le", _number(bound))]), count))
+                out.append((f"{self.name}_sum", _labels(self.labelnames, key), state[-2]))
+                out.append((f"{self.name}_count", _labels(self.labelnames, key), state[-1]))
+        return out
+
+
+class CallbackGauge:
+    """Gauge whose samples come from `collect()` -> {label values tuple: value} at render time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, doc, labelnames, collect):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        try:
+            values = self.collect()
+        except Exception:
+            return []
+        return [(self.name, _labels(self.labelnames, key), value) for key, value in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, doc, labelnames=()):
+        return self.register(Counter(name, doc, labelnames))
+
+    def histogram(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, doc, labelnames, buckets))
+
+    def gauge(self, name, doc, labelnames, collect):
+        return self.register(CallbackGauge(name, doc, labelnames, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+NODE_SECONDS = REGISTRY.histogram(
+    "citybrain_node_seconds", "Latency of each LangGraph node.", ("node",)
+)
+DEPENDENCY_SECONDS = REGISTRY.histogram(
+    "citybrain_dependency_seconds", "Latency of calls to external dependencies.", ("dependency", "target")
+)
+DEPENDENCY_ERRORS = REGISTRY.counter(
+    "citybrain_dependency_errors_total", "Failed calls to external dependencies.", ("dependency", "target")
+)
+
+
+def watch_cache(cache):
+    """Exports a TTLCache's lookup counters, hit ratio and size as gauges."""
+    REGISTRY.gauge(
+        f"citybrain_{cache.name}_cache_lookups", f"Lookups on the {cache.name} cache by outcome.", ("outcome",),
+        lambda: {("hit",): cache.hits, ("stale",): cache.stale_hits, ("miss",): cache.misses},
+    )
+    REGISTRY.gauge(
+        f"citybrain_{cache.name}_cache_hit_ratio", f"Share of {cache.name} cache lookups served from cache.", (),
+        lambda: {(): cache.stats()["hit_rate"]},
+    )
+    REGISTRY.gauge(
+        f"citybrain_{cache.name}_cache_entries", f"Entries held by the {cache.name} cache.", (),
+        lambda: {(): len(cache)},
+    )
+
+
+@contextmanager
+def track_dependency(dependency, target):
+    """Times a dependency call and counts it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, target=target)
+        raise
+    finally:
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - started, dependency=dependency, target=target)
+
+
+def instrument_node(name, fn):
+    """Wraps a LangGraph node so its latency lands in citybrain_node_seconds."""
+    def node(state):
+        with NODE_SECONDS.time(node=name):
+            return fn(state)
+    node.__name__ = getattr(fn, "__name__", name)
+    return node
@@ -0,0 +1,262 @@
+"""
+Pooled client for the Open Government Data platform (api.data.gov.in).
+
+Every resource fetch goes through one keep-alive `requests.Session` and a
+shared thread pool, so a city analysis fires all of its OGD calls at once
+instead of paying each 5s timeout one after another.
+"""
+import os
+import json
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import TTLCache
+from metrics import DEPENDENCY_ERRORS, track_dependency, watch_cache
+
+logger = logging.getLogger(__name__)
+
+OGD_BASE_URL = os.getenv("OGD_BASE_URL", "https://api.data.gov.in/resource")
+
+# Per-call timeout (seconds) handed to requests, and the overall budget for
+# one fan-out. Anything still running at the deadline is reported as missing.
+OGD_CALL_TIMEOUT = float(os.getenv("OGD_CALL_TIMEOUT", "5"))
+OGD_TOTAL_DEADLINE = float(os.getenv("OGD_TOTAL_DEADLINE", "8"))
+OGD_POOL_SIZE = int(os.getenv("OGD_POOL_SIZE", "16"))
+
+# Response cache. AQI refreshes hourly, the other datasets far less often.
+# OGD_CACHE_TTL overrides the default for resources not listed here.
+OGD_CACHE_TTL = float(os.getenv("OGD_CACHE_TTL", "3600"))
+OGD_RESOURCE_TTLS = {
+    "3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69": 900,     # AQI
+    "6c05cd1b-ed59-40c2-bc31-e314f39c6971": 3600,    # Rainfall
+    "8c55baee-3e42-457f-92c4-a0005e954bcc": 3600,    # Power
+    "d23c7de6-867b-4679-b8c7-36ee8a95b15b": 86400,   # Ground water
+    "4554a3c8-74e3-4f93-8727-8fd92161e345": 86400,   # Soil health
+}
+# Empty/failed responses are remembered briefly so cities without data
+# don't hit the API on every request.
+OGD_NEGATIVE_TTL = float(os.getenv("OGD_NEGATIVE_TTL", "300"))
+# How long past expiry a cached copy may still be served while it refreshes.
+OGD_STALE_TTL = float(os.getenv("OGD_STALE_TTL", "3600"))
+OGD_CACHE_SIZE = int(os.getenv("OGD_CACHE_SIZE", "512"))
+
+# Cached in place of records for OGD_NEGATIVE_TTL after a failed fetch, so
+# a down or slow API isn't called again by every analysis; callers get None
+FAILED = object()
+
+ogd_cache = TTLCache(maxsize=OGD_CACHE_SIZE, ttl=OGD_CACHE_TTL, stale_ttl=OGD_STALE_TTL, name="ogd")
+watch_cache(ogd_cache)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+# Misses currently being fetched, so concurrent callers asking for the same
+# (resource_id, filters) - e.g. two cities in one state - share one API call.
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
+
+OGD_EXECUTOR = ThreadPoolExecutor(max_workers=OGD_POOL_SIZE, thread_name_prefix="ogd")
+
+
+def get_session():
+    """Shared keep-alive session, created on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=OGD_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def cache_key(resource_id, filters=None):
+    """resource_id plus filters normalized for case, whitespace and order."""
+    normalized = tuple(sorted(
+        (str(k).strip().lower(), str(v).strip().lower()) for k, v in (filters or {}).items()
+    ))
+    return resource_id, normalized
+
+
+def _store(key, resource_id, records):
+    if records is None:
+        # Never served stale: once it expires the next caller retries
+        ogd_cache.set(key, FAILED, ttl=OGD_NEGATIVE_TTL, stale_ttl=0)
+        return
+    ttl = OGD_RESOURCE_TTLS.get(resource_id, OGD_CACHE_TTL) if records else OGD_NEGATIVE_TTL
+    ogd_cache.set(key, records, ttl=ttl)
+
+
+def _refresh(key, resource_id, filters, timeout):
+    try:
+        records = _fetch_from_api(resource_id, filters, timeout)
+        # A failed refresh keeps serving the stale copy until it ages out
+        if records is not None:
+            _store(key, resource_id, records)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def fetch_ogd_resource(resource_id, filters=None, timeout=None):
+    """
+    Cached front for `_fetch_from_api`.
+
+    Fresh hits return immediately. Stale hits also return immediately and
+    schedule one background refresh per key. Misses fetch synchronously, and
+    concurrent misses for the same key wait on the first caller's fetch.
+    Returns None when the call failed. Empty responses and failed misses are
+    negative-cached for OGD_NEGATIVE_TTL; a failed refresh of a stale entry
+    keeps the stale copy instead.
+    """
+    key = cache_key(resource_id, filters)
+    found = ogd_cache.lookup(key)
+
+    if found is not None:
+        records, is_fresh = found
+        if records is FAILED:
+            return None
+        if not is_fresh:
+            with _refreshing_lock:
+                start_refresh = key not in _refreshing
+                _refreshing.add(key)
+            if start_refresh:
+                logger.debug("[API CACHE] Serving stale %s, refreshing in background.", resource_id)
+                OGD_EXECUTOR.submit(_refresh, key, resource_id, filters, timeout)
+        return records
+
+    with _inflight_lock:
+        pending = _inflight.get(key)
+        leader = pending is None
+        if leader:
+            pending = _inflight[key] = Future()
+    if not leader:
+        return pending.result()
+
+    records = None
+    try:
+        records = _fetch_from_api(resource_id, filters, timeout)
+        _store(key, resource_id, records)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        pending.set_result(records)
+    return records
+
+
+def _get(resource_id, params, timeout=None):
+    """One GET against a resource: the decoded JSON body, or None on failure."""
+    try:
+        with track_dependency("ogd", resource_id):
+            response = get_session().get(
+                f"{OGD_BASE_URL}/{resource_id}", params=params, timeout=timeout or OGD_CALL_TIMEOUT
+            )
+
+        # --- LOGGING POINT 2: Did it work? ---
+        logger.debug("[API RESPONSE] Status: %s", response.status_code)
+
+        if response.status_code == 200:
+            return response.json()
+        DEPENDENCY_ERRORS.inc(dependency="ogd", target=resource_id)
+        logger.warning("[API ERROR] Failed %s: %s", resource_id, response.status_code)
+    except Exception as e:
+        logger.warning("[API EXCEPTION] Error %s: %s", resource_id, e)
+    return None
+
+
+def _fetch_from_api(resource_id, filters=None, timeout=None):
+    """
+    Generic function to hit api.data.gov.in with DEBUG logging. Returns the
+    records (possibly empty), or None if the key is missing or the call failed.
+    """
+    api_key = os.getenv("GOVT_DATA_API")
+    if not api_key:
+        logger.warning("⚠️ GOVT_DATA_API key missing in .env")
+        return None
+
+    # Use limit 20 to increase odds of finding valid data
+    params = {
+        "api-key": api_key,
+        "format": "json",
+        "limit": 20
+    }
+
+    if filters:
+        for k, v in filters.items():
+            params[f"filters[{k}]"] = v
+
+    # --- LOGGING POINT 1: What are we asking for? ---
+    logger.debug("[API REQUEST] ID: %s | Filters: %s", resource_id, filters)
+
+    data = _get(resource_id, params, timeout)
+    if data is None:
+        return None
+    records = data.get("records", [])
+
+    # --- LOGGING POINT 3: What did we get? ---
+    logger.debug("[API DATA] %s: found %d records.", resource_id, len(records))
+    if records:
+        # Dump the first record to see if fields like 'pollutant_avg' are actually present
+        # (only serialized when debug logging is on)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[API SAMPLE] %s", json.dumps(records[0]))
+    else:
+        logger.info("[API WARNING] %s returned 0 records for %s (Check city spelling or API limit).", resource_id, filters)
+
+    return records
+
+
+def fetch_page(resource_id, offset, limit, timeout=None):
+    """
+    One unfiltered page of a resource for bulk ingestion (see ogd_store.py).
+    Returns `(records, total)`, where `total` is the resource's record count
+    (None if the API left it out), or None if the page could not be fetched.
+    """
+    api_key = os.getenv("GOVT_DATA_API")
+    if not api_key:
+        return None
+    params = {"api-key": api_key, "format": "json", "offset": offset, "limit": limit}
+    data = _get(resource_id, params, timeout)
+    if data is None:
+        return None
+    total = data.get("total")
+    try:
+        total = int(total) if total is not None else None
+    except (TypeError, ValueError):
+        total = None
+    return data.get("records", []), total
+
+
+def fan_out(jobs, deadline=None):
+    """
+    Runs independent fetches concurrently on the shared pool.
+
+    `jobs` maps a name to a zero-argument callable. Returns `(results, missed)`
+    where `results` holds the value of every job that finished inside the
+    overall deadline and `missed` lists the names that did not (timed out or
+    raised). Late jobs keep running in the background but never block the caller.
+    """
+    futures = {OGD_EXECUTOR.submit(fn): name for name, fn in jobs.items()}
+    done, _ = wait(futures, timeout=deadline or OGD_TOTAL_DEADLINE)
+
+    results = {}
+    missed = []
+    for future, name in futures.items():
+        if future not in done:
+            logger.warning("[API DEADLINE] '%s' missed the %ss budget.", name, deadline or OGD_TOTAL_DEADLINE)
+            missed.append(name)
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            logger.warning("[API EXCEPTION] '%s' failed: %s", name, e)
+            missed.append(name)
+
+    return results, missed
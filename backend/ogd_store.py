@@ -0,0 +1,255 @@
+"""
+Local, indexed copy of whole OGD resources.
+
+`fetch_ogd_resource` asks the API for 20 filtered rows per call, so callers
+only ever see a sample (AQI for a big city is whichever station came first).
+Resources listed in OGD_INGEST_RESOURCES are instead paged through in full,
+pages fetched in parallel on the OGD pool, and stored in SQLite indexed by
+city, district, state and pollutant. `lookup` answers from that copy while it
+is fresh and falls back to the API otherwise.
+"""
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+
+from ogd_client import OGD_EXECUTOR, OGD_RESOURCE_TTLS, OGD_CACHE_TTL, OGD_STALE_TTL, fetch_page, fetch_ogd_resource
+
+logger = logging.getLogger(__name__)
+
+# Set OGD_INGEST=0 to always query the API
+OGD_INGEST = os.getenv("OGD_INGEST", "1") == "1"
+OGD_STORE_PATH = os.getenv(
+    "OGD_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ogd_store.sqlite3")
+)
+# AQI, rainfall and power by default; ground water and soil health are far
+# larger and stay on filtered API calls
+OGD_INGEST_RESOURCES = [
+    resource_id.strip() for resource_id in os.getenv(
+        "OGD_INGEST_RESOURCES",
+        "3b01bcb8-0b14-4abf-b6f2-c1bfd384ba69,6c05cd1b-ed59-40c2-bc31-e314f39c6971,8c55baee-3e42-457f-92c4-a0005e954bcc",
+    ).split(",") if resource_id.strip()
+]
+OGD_PAGE_SIZE = int(os.getenv("OGD_PAGE_SIZE", "1000"))
+OGD_INGEST_MAX_RECORDS = int(os.getenv("OGD_INGEST_MAX_RECORDS", "100000"))
+# Pages in flight at once, so ingestion leaves most of the OGD pool to requests
+OGD_INGEST_CONCURRENCY = int(os.getenv("OGD_INGEST_CONCURRENCY", "4"))
+OGD_INGEST_CHECK_SECONDS = float(os.getenv("OGD_INGEST_CHECK_SECONDS", "60"))
+# After a failed ingest the resource is retried after CHECK_SECONDS, doubling
+# with each further failure up to this many seconds
+OGD_INGEST_MAX_BACKOFF = float(os.getenv("OGD_INGEST_MAX_BACKOFF", "3600"))
+
+# API filter names -> indexed column
+FILTER_COLUMNS = {
+    "city": "city",
+    "district": "district",
+    "district_name": "district",
+    "state": "state",
+    "state_name": "state",
+    "pollutant_id": "pollutant",
+}
+
+
+def _key(value):
+    return str(value).strip().lower() if value not in (None, "") else None
+
+
+def _columns(record):
+    return (
+        _key(record.get("city")),
+        _key(record.get("district") or record.get("district_name")),
+        _key(record.get("state") or record.get("state_name")),
+        _key(record.get("pollutant_id")),
+    )
+
+
+class OGDStore:
+    """One SQLite table of records per ingested resource, replaced atomically on re-ingest."""
+
+    def __init__(self, path=OGD_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS records (
+                   resource_id TEXT NOT NULL,
+                   city TEXT, district TEXT, state TEXT, pollutant TEXT,
+                   payload TEXT NOT NULL
+               );
+               CREATE INDEX IF NOT EXISTS records_city ON records (resource_id, city, pollutant);
+               CREATE INDEX IF NOT EXISTS records_district ON records (resource_id, district);
+               CREATE INDEX IF NOT EXISTS records_state ON records (resource_id, state);
+               CREATE TABLE IF NOT EXISTS ingests (
+                   resource_id TEXT PRIMARY KEY,
+                   ingested_at REAL NOT NULL,
+                   total INTEGER NOT NULL
+               );"""
+        )
+        self._conn.commit()
+
+    def ingested_at(self, resource_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ingested_at FROM ingests WHERE resource_id = ?", (resource_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def replace(self, resource_id, records):
+        rows = [(resource_id, *_columns(record), json.dumps(record, separators=(",", ":"))) for record in records]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records WHERE resource_id = ?", (resource_id,))
+            self._conn.executemany(
+                "INSERT INTO records (resource_id, city, district, state, pollutant, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ingests (resource_id, ingested_at, total) VALUES (?, ?, ?)",
+                (resource_id, time.time(), len(rows)),
+            )
+
+    def query(self, resource_id, filters):
+        """Records matching every filter (case-insensitive), in API order."""
+        clauses, params = ["resource_id = ?"], [resource_id]
+        for name, value in filters.items():
+            clauses.append(f"{FILTER_COLUMNS[name]} = ?")
+            params.append(_key(value))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT payload FROM records WHERE {' AND '.join(clauses)} ORDER BY rowid", params
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+def ingest(store, resource_id, page_size=OGD_PAGE_SIZE, max_records=OGD_INGEST_MAX_RECORDS):
+    """
+    Pages through a whole resource: the first page gives the total, the rest
+    are fetched in parallel. Returns the record count, or None if any page
+    failed (the previous copy is kept).
+    """
+    started = time.perf_counter()
+    first = fetch_page(resource_id, 0, page_size)
+    if first is None:
+        return None
+    records, total = first
+
+    if total is None:
+        # No total in the response: walk pages one at a time until a short one
+        offset = len(records)
+        page = records
+        while len(page) == page_size and offset < max_records:
+            fetched = fetch_page(resource_id, offset, page_size)
+            if fetched is None:
+                return None
+            page = fetched[0]
+            records.extend(page)
+            offset += len(page)
+    else:
+        offsets = list(range(len(records), min(total, max_records), page_size)) if records else []
+        for i in range(0, len(offsets), OGD_INGEST_CONCURRENCY):
+            futures = [
+                OGD_EXECUTOR.submit(fetch_page, resource_id, offset, page_size)
+                for offset in offsets[i:i + OGD_INGEST_CONCURRENCY]
+            ]
+            for future in futures:
+                fetched = future.result()
+                if fetched is None:
+                    return None
+                records.extend(fetched[0])
+
+    store.replace(resource_id, records[:max_records])
+    logger.info(
+        "[INGEST] 📥 %s: %d records in %.1fs.", resource_id, min(len(records), max_records),
+        time.perf_counter() - started
+    )
+    return len(records)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Shared store, opened on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = OGDStore()
+    return _store
+
+
+def _ttl(resource_id):
+    return OGD_RESOURCE_TTLS.get(resource_id, OGD_CACHE_TTL)
+
+
+def lookup(resource_id, filters=None):
+    """
+    Local indexed query when `resource_id` has been ingested recently enough
+    (within its cache TTL plus OGD_STALE_TTL), `fetch_ogd_resource` otherwise.
+    """
+    filters = filters or {}
+    if OGD_INGEST and resource_id in OGD_INGEST_RESOURCES and all(name in FILTER_COLUMNS for name in filters):
+        store = get_store()
+        ingested_at = store.ingested_at(resource_id)
+        if ingested_at and time.time() - ingested_at < _ttl(resource_id) + OGD_STALE_TTL:
+            return store.query(resource_id, filters)
+    return fetch_ogd_resource(resource_id, filters)
+
+
+class Ingester:
+    """
+    Daemon thread re-ingesting each resource once its TTL has passed. A
+    resource whose ingest fails is retried with exponential backoff rather
+    than on every check.
+    """
+
+    def __init__(self, resources=OGD_INGEST_RESOURCES, check_seconds=OGD_INGEST_CHECK_SECONDS,
+                 max_backoff=OGD_INGEST_MAX_BACKOFF):
+        self.resources = resources
+        self.check_seconds = check_seconds
+        self.max_backoff = max_backoff
+        self._failures = {}     # resource_id -> (consecutive failures, next attempt at)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _failed(self, resource_id, error):
+        failures = self._failures.get(resource_id, (0, 0))[0] + 1
+        delay = min(self.check_seconds * 2 ** failures, self.max_backoff)
+        self._failures[resource_id] = (failures, time.time() + delay)
+        logger.warning(
+            "[INGEST] ⚠️ %s failed (%s), keeping API lookups; attempt %d, retrying in %.0fs.",
+            resource_id, error, failures, delay
+        )
+
+    def run_once(self):
+        store = get_store()
+        for resource_id in self.resources:
+            ingested_at = store.ingested_at(resource_id)
+            if ingested_at and time.time() - ingested_at < _ttl(resource_id):
+                continue
+            if time.time() < self._failures.get(resource_id, (0, 0))[1]:
+                continue
+            try:
+                count, error = ingest(store, resource_id), "a page could not be fetched"
+            except Exception as e:
+                count, error = None, e
+            if count is None:
+                self._failed(resource_id, error)
+            else:
+                self._failures.pop(resource_id, None)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.check_seconds)
+
+    def start(self):
+        if self._thread is None and self.resources:
+            self._thread = threading.Thread(target=self._loop, name="ogd-ingest", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
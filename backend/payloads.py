@@ -0,0 +1,102 @@
+"""
+Versioned, compact /analyze-city responses.
+
+- Every payload gets an ETag built from the city's data version, so clients
+  holding the current version get a bodyless 304.
+- Markers carry stable ids, so a client that sends the version it already
+  has receives only the markers added, changed or removed since then.
+- Bodies are compact JSON, or msgpack when the client asks for
+  `application/msgpack` and the optional `msgpack` package is installed,
+  gzipped when the client accepts it.
+"""
+import os
+import gzip
+import json
+import hashlib
+from collections import Counter
+
+from fastapi import Response
+
+try:
+    import msgpack
+except ImportError:     # optional: JSON only without it
+    msgpack = None
+
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+
+APPROX_SUFFIX = " (Approx)"
+
+
+def payload_etag(city_key, version, updated_at):
+    return f'"{city_key}-{version}-{int(updated_at * 1000)}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    # Weak comparison: W/"x" matches "x"
+    candidates |= {tag[2:] for tag in candidates if tag.startswith("W/")}
+    return "*" in candidates or etag in candidates
+
+
+def marker_ids(markers):
+    """
+    Stable ids from a marker's category, place and source. The cartographer's
+    " (Approx)" suffix is ignored so a marker keeps its id when geocoding of
+    its place starts or stops succeeding; repeats get a numeric suffix.
+    """
+    seen = Counter()
+    ids = []
+    for marker in markers:
+        if marker.get("id"):
+            ids.append(marker["id"])
+            continue
+        name = str(marker.get("location_name", ""))
+        if name.endswith(APPROX_SUFFIX):
+            name = name[:-len(APPROX_SUFFIX)]
+        source = "gov" if marker.get("is_gov_data") else "report" if marker.get("is_real_report") else "ai"
+        base = hashlib.sha1(f"{marker.get('category', '')}\x1f{name}\x1f{source}".encode("utf-8")).hexdigest()[:12]
+        seen[base] += 1
+        ids.append(base if seen[base] == 1 else f"{base}-{seen[base]}")
+    return ids
+
+
+def assign_marker_ids(markers):
+    for marker, marker_id in zip(markers, marker_ids(markers)):
+        marker["id"] = marker_id
+    return markers
+
+
+def diff_markers(old, new):
+    """`(added, changed, removed_ids)` going from marker list `old` to `new`."""
+    old_by_id = dict(zip(marker_ids(old), old))
+    new_by_id = dict(zip(marker_ids(new), new))
+    added = [marker for marker_id, marker in new_by_id.items() if marker_id not in old_by_id]
+    changed = [
+        marker for marker_id, marker in new_by_id.items()
+        if marker_id in old_by_id and old_by_id[marker_id] != marker
+    ]
+    removed = [marker_id for marker_id in old_by_id if marker_id not in new_by_id]
+    return added, changed, removed
+
+
+def _default(value):
+    # Firestore timestamps and other datetimes
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def encode_response(payload, accept="", accept_encoding="", headers=None):
+    """Serializes `payload` in the most compact encoding the client accepts."""
+    headers = dict(headers or {}, Vary="Accept, Accept-Encoding")
+    if msgpack is not None and "application/msgpack" in accept:
+        body = msgpack.packb(payload, default=_default, use_bin_type=True)
+        media_type = "application/msgpack"
+    else:
+        body = json.dumps(payload, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        media_type = "application/json"
+    if "gzip" in accept_encoding and len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type=media_type, headers=headers)
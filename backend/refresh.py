@@ -0,0 +1,147 @@
+"""
+Background refresh of popular cities.
+
+Every successful /analyze-city request bumps a city's popularity score,
+which halves every REFRESH_HALF_LIFE seconds so yesterday's spike fades.
+At most REFRESH_MAX_TRACKED cities are tracked; the least popular is dropped
+when a new one arrives. The top REFRESH_TOP_N cities (plus, when seeding is
+turned on, known cities with a small seed score) are re-analyzed once their
+snapshot is older than a jittered REFRESH_INTERVAL, at most
+REFRESH_CONCURRENCY at a time, so requests find a warm snapshot.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "1800"))
+# Each city's interval is drawn from interval * (1 +/- REFRESH_JITTER) so
+# cities analyzed together don't all come due on the same tick
+REFRESH_JITTER = float(os.getenv("REFRESH_JITTER", "0.2"))
+REFRESH_TOP_N = int(os.getenv("REFRESH_TOP_N", "8"))
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", "1"))
+REFRESH_TICK = float(os.getenv("REFRESH_TICK", "30"))
+REFRESH_HALF_LIFE = float(os.getenv("REFRESH_HALF_LIFE", str(6 * 3600)))
+REFRESH_MAX_TRACKED = int(os.getenv("REFRESH_MAX_TRACKED", "256"))
+# Known cities rank below any city that was actually requested
+REFRESH_SEED_SCORE = 0.5
+
+
+class RefreshScheduler:
+    """
+    `refresh(city)` is a coroutine function that re-analyzes one city;
+    `age_of(city_key)` returns its snapshot age in seconds, or None.
+    """
+
+    def __init__(self, refresh, age_of, seeds=(), interval=REFRESH_INTERVAL, jitter=REFRESH_JITTER,
+                 top_n=REFRESH_TOP_N, concurrency=REFRESH_CONCURRENCY, tick=REFRESH_TICK,
+                 half_life=REFRESH_HALF_LIFE, max_tracked=REFRESH_MAX_TRACKED):
+        self.refresh = refresh
+        self.age_of = age_of
+        self.interval = interval
+        self.jitter = jitter
+        self.top_n = top_n
+        self.concurrency = concurrency
+        self.tick = tick
+        self.half_life = half_life
+        self.max_tracked = max_tracked
+        self._scores = {}       # city_key -> [score, scored_at, city name]
+        self._due_after = {}    # city_key -> jittered interval for the current snapshot
+        self._running = set()
+        self._tasks = set()
+        self._loop_task = None
+        self._lock = threading.Lock()
+        self.refreshed = 0
+        self.failed = 0
+        now = time.time()
+        for city in seeds:
+            self._scores[city.lower().strip()] = [REFRESH_SEED_SCORE, now, city]
+
+    def _decayed(self, score, scored_at, now):
+        return score * 0.5 ** ((now - scored_at) / self.half_life)
+
+    def record(self, city):
+        """Counts one successful request for `city`."""
+        city_key = city.lower().strip()
+        now = time.time()
+        with self._lock:
+            entry = self._scores.get(city_key)
+            if entry is None and len(self._scores) >= self.max_tracked:
+                coldest = min(self._scores, key=lambda key: self._decayed(*self._scores[key][:2], now))
+                del self._scores[coldest]
+                self._due_after.pop(coldest, None)
+            score = self._decayed(entry[0], entry[1], now) if entry else 0.0
+            self._scores[city_key] = [score + 1, now, city.strip()]
+
+    def popular(self):
+        """The top_n city names by decayed score."""
+        now = time.time()
+        with self._lock:
+            ranked = sorted(
+                self._scores.items(), key=lambda item: self._decayed(item[1][0], item[1][1], now), reverse=True
+            )
+        return [(city_key, entry[2]) for city_key, entry in ranked[:self.top_n]]
+
+    def due(self):
+        """Popular cities with no snapshot or one older than their jittered interval."""
+        cities = []
+        for city_key, city in self.popular():
+            if city_key in self._running:
+                continue
+            age = self.age_of(city_key)
+            due_after = self._due_after.setdefault(
+                city_key, self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            )
+            if age is None or age >= due_after:
+                cities.append((city_key, city))
+        return cities
+
+    async def _refresh_one(self, city_key, city):
+        started = time.perf_counter()
+        try:
+            await self.refresh(city)
+            self.refreshed += 1
+            logger.info("[REFRESH] ♻️ %s refreshed in %.1fs.", city, time.perf_counter() - started)
+        except Exception as e:
+            self.failed += 1
+            logger.warning("[REFRESH] ⚠️ Refresh of %s failed: %s", city, e)
+        finally:
+            self._running.discard(city_key)
+            # Fresh jitter for the next round
+            self._due_after.pop(city_key, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick * random.uniform(0.5, 1.5))
+            for city_key, city in self.due():
+                if len(self._running) >= self.concurrency:
+                    break
+                self._running.add(city_key)
+                task = asyncio.create_task(self._refresh_one(city_key, city))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        """Starts the scheduling loop on the running event loop."""
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+
+    def stop(self):
+        for task in [self._loop_task, *self._tasks]:
+            if task is not None:
+                task.cancel()
+        self._loop_task = None
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._scores)
+        return {
+            "tracked": tracked,
+            "running": len(self._running),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
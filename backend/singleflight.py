@@ -0,0 +1,32 @@
+"""
+Coalesces concurrent async calls that share a key into one in-flight run.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    `await flights.do(key, factory)` runs `factory()` (which returns an
+    awaitable) unless a call for the same key is already running, in which
+    case it waits for and returns that call's result instead.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    def is_running(self, key):
+        return key in self._inflight
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.info("[FLIGHT] Joining in-flight run for '%s'.", key)
+        # Shield so one caller disconnecting doesn't cancel the shared run
+        return await asyncio.shield(task)
@@ -0,0 +1,203 @@
+"""
+Spatial helpers: near-duplicate consolidation of citizen reports, and a
+grid index over map markers for viewport queries and clustering.
+"""
+import os
+import math
+
+CLUSTER_RADIUS_M = float(os.getenv("CLUSTER_RADIUS_M", "75"))
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+# Defaults the app and issue_from_doc fill in when no place was given; such
+# reports are only told apart by their description
+PLACEHOLDER_NAMES = {"", "unknown"}
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    d_lat = p2 - p1
+    d_lng = math.radians(lng2 - lng1)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(d_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _normalize(text):
+    return " ".join(str(text or "").lower().split())
+
+
+def _merge(cluster, report):
+    """Folds `report` into `cluster`, moving the centroid to the running mean."""
+    count = cluster["report_count"]
+    if cluster.get("has_coords"):
+        cluster["lat"] = (cluster["lat"] * count + report["lat"]) / (count + 1)
+        cluster["lng"] = (cluster["lng"] * count + report["lng"]) / (count + 1)
+    cluster["report_count"] = count + 1
+    cluster["report_ids"].append(report.get("id"))
+
+
+def _seed(report):
+    cluster = dict(report)
+    cluster["report_count"] = 1
+    cluster["report_ids"] = [report.get("id")]
+    return cluster
+
+
+def consolidate_reports(reports, radius_m=CLUSTER_RADIUS_M):
+    """
+    Merges duplicate and near-duplicate citizen reports into weighted
+    representatives carrying `report_count` and `report_ids`.
+
+    - Exact duplicates (same category, location name, description and
+      position) collapse through a dict lookup.
+    - Geolocated reports of the same category within `radius_m` of a cluster
+      centroid join that cluster. Reports are bucketed on a grid of
+      `radius_m` cells and only the 3x3 neighbourhood is searched, so this
+      stays linear in the number of reports.
+    - Text-only reports with the same category and location name merge, since
+      they would be geocoded to the same place anyway. Reports with a
+      placeholder name ("Unknown") only merge with exact duplicates, since
+      their place still has to be inferred from the description.
+    """
+    exact = {}
+    by_name = {}
+    grid = {}
+    clusters = []
+    cell_lat = radius_m / METERS_PER_DEGREE
+
+    for report in reports:
+        category = _normalize(report.get("category"))
+        name = _normalize(report.get("location_name"))
+
+        position = (round(report["lat"], 5), round(report["lng"], 5)) if report.get("has_coords") else None
+        exact_key = (category, name, _normalize(report.get("description")), position)
+        if exact_key in exact:
+            _merge(exact[exact_key], report)
+            continue
+
+        if not report.get("has_coords"):
+            if name in PLACEHOLDER_NAMES:
+                cluster = exact[exact_key] = _seed(report)
+                clusters.append(cluster)
+                continue
+            cluster = by_name.get((category, name))
+            if cluster is None:
+                cluster = by_name[(category, name)] = _seed(report)
+                clusters.append(cluster)
+            else:
+                _merge(cluster, report)
+            exact[exact_key] = cluster
+            continue
+
+        lat, lng = report["lat"], report["lng"]
+        cell_lng = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        row, col = math.floor(lat / cell_lat), math.floor(lng / cell_lng)
+
+        match = None
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                for candidate in grid.get((category, row + d_row, col + d_col), ()):
+                    if haversine_m(lat, lng, candidate["lat"], candidate["lng"]) <= radius_m:
+                        match = candidate
+                        break
+                if match:
+                    break
+            if match:
+                break
+
+        if match is None:
+            match = _seed(report)
+            grid.setdefault((category, row, col), []).append(match)
+            clusters.append(match)
+        else:
+            _merge(match, report)
+        exact[exact_key] = match
+
+    return clusters
+
+
+# --- Marker index / viewport clustering ---
+
+INDEX_CELL_DEG = float(os.getenv("MARKER_INDEX_CELL_DEG", "0.01"))   # ~1 km
+CLUSTER_PIXELS = int(os.getenv("MARKER_CLUSTER_PIXELS", "60"))
+
+
+def cluster_cell_deg(zoom):
+    """Degrees covered by CLUSTER_PIXELS on a 256px web-mercator tile at `zoom`."""
+    return CLUSTER_PIXELS * 360.0 / (256 * 2 ** max(0, min(int(zoom), 22)))
+
+
+class MarkerGrid:
+    """
+    Uniform grid over a city's map markers for bounding-box queries and
+    server-side clustering, so payloads stay flat as markers grow.
+    """
+
+    def __init__(self, markers, cell_deg=INDEX_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.cells = {}
+        self.size = 0
+        for marker in markers:
+            if marker.get("lat") is None or marker.get("lng") is None:
+                continue
+            self.cells.setdefault(self._cell(marker["lat"], marker["lng"]), []).append(marker)
+            self.size += 1
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def query(self, south, west, north, east):
+        """Markers inside the box, visiting whichever is fewer: box cells or occupied cells."""
+        row_min, col_min = self._cell(south, west)
+        row_max, col_max = self._cell(north, east)
+        box_cells = (row_max - row_min + 1) * (col_max - col_min + 1)
+
+        if box_cells <= len(self.cells):
+            candidates = (
+                self.cells.get((row, col), ())
+                for row in range(row_min, row_max + 1)
+                for col in range(col_min, col_max + 1)
+            )
+        else:
+            candidates = (
+                markers for (row, col), markers in self.cells.items()
+                if row_min <= row <= row_max and col_min <= col <= col_max
+            )
+
+        return [
+            m for markers in candidates for m in markers
+            if south <= m["lat"] <= north and west <= m["lng"] <= east
+        ]
+
+    def clusters(self, south, west, north, east, zoom):
+        """
+        Groups the markers in the box into zoom-sized cells. Cells holding a
+        single marker return it unchanged; others return one cluster with a
+        weighted centroid, a report count and a category breakdown.
+        """
+        size = cluster_cell_deg(zoom)
+        groups = {}
+        for marker in self.query(south, west, north, east):
+            key = (math.floor(marker["lat"] / size), math.floor(marker["lng"] / size))
+            groups.setdefault(key, []).append(marker)
+
+        markers, clusters = [], []
+        for group in groups.values():
+            if len(group) == 1:
+                markers.append(group[0])
+                continue
+            weights = [m.get("report_count", 1) for m in group]
+            total = sum(weights)
+            categories = {}
+            for m, weight in zip(group, weights):
+                categories[m.get("category", "general")] = categories.get(m.get("category", "general"), 0) + weight
+            clusters.append({
+                "lat": sum(m["lat"] * w for m, w in zip(group, weights)) / total,
+                "lng": sum(m["lng"] * w for m, w in zip(group, weights)) / total,
+                "marker_count": len(group),
+                "report_count": total,
+                "categories": categories,
+                "negative": sum(1 for m in group if m.get("sentiment") == "negative"),
+            })
+        return markers, clusters
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+# Backend modules import each other as top-level modules ("from cache import ...")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read when main.py is imported: no snapshots, ingestion, listener or
+# background refreshes, nothing written into the source tree, and no
+# Nominatim rate limit in front of the fake geocoder
+os.environ.update({
+    "CITY_SNAPSHOT_PATH": "",
+    "CITY_STORE_SHARED_PATH": "",
+    "OGD_INGEST": "0",
+    "CITIZEN_INDEX": "0",
+    "REFRESH_SCHEDULER": "0",
+    "GEOCODE_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="citybrain-tests-"), "geocode.sqlite3"),
+    "NOMINATIM_RPS": "1000",
+    "NOMINATIM_BURST": "1000",
+})
@@ -0,0 +1,70 @@
+"""
+Drives /analyze-city/stream end to end against the benchmark fakes.
+"""
+import asyncio
+
+import pytest
+
+for module in ("fastapi", "firebase_admin", "httpx", "langchain_core", "langgraph"):
+    pytest.importorskip(module)
+
+import httpx  # noqa: E402
+
+import deps  # noqa: E402
+import geocoding  # noqa: E402
+import main  # noqa: E402
+import ogd_client  # noqa: E402
+from bench.fakes import FakeChatModel, FakeFirestore, FakeGeocoder, FakeOGDServer  # noqa: E402
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    ogd = FakeOGDServer(latency=0).start()
+    monkeypatch.setenv("GOVT_DATA_API", "test")
+    monkeypatch.setattr(ogd_client, "OGD_BASE_URL", ogd.base_url)
+    monkeypatch.setattr(deps, "db", FakeFirestore(["pune"], reports_per_city=10, latency=0))
+    monkeypatch.setattr(deps, "llm", FakeChatModel(latency=0, token_delay=0))
+    monkeypatch.setattr(geocoding, "geolocator", FakeGeocoder(latency=0))
+    yield
+    ogd.stop()
+
+
+def stream(*paths):
+    """Requests every path concurrently; returns each response's SSE event names."""
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.get(path, timeout=60) for path in paths))
+
+    return [
+        [line[len("event: "):] for line in response.text.splitlines() if line.startswith("event: ")]
+        for response in asyncio.run(run())
+    ]
+
+
+def test_stream_sends_progress_then_the_payload(fakes):
+    (events,) = stream("/analyze-city/stream?city=Pune&force=true")
+    assert events[0] in ("city_center", "gov_data")
+    assert "citizen_stats" in events
+    assert events[-1] == "done"
+
+    # The snapshot is now fresh, so it is sent straight away
+    (events,) = stream("/analyze-city/stream?city=Pune")
+    assert events == ["done"]
+
+
+def test_concurrent_streams_share_one_run(fakes, monkeypatch):
+    runs = []
+    analyze = main.stream_city_analysis
+    monkeypatch.setattr(main, "stream_city_analysis", lambda city, emit: runs.append(city) or analyze(city, emit))
+
+    results = stream(*["/analyze-city/stream?city=Pune&force=true"] * 3)
+    assert len(runs) == 1
+    assert all(events[-1] == "done" for events in results)
+
+
+def test_stream_starts_its_own_run_when_a_flight_has_just_finished(fakes, monkeypatch):
+    # The flight looks in progress but has already resolved, so there is nothing to join
+    monkeypatch.setattr(main.analysis_flights, "is_running", lambda key: True)
+    (events,) = stream("/analyze-city/stream?city=Pune&force=true")
+    assert events[-1] == "done"
@@ -0,0 +1,143 @@
+"""
+Drives CitizenReportIndex with add/modify/remove events the way the Firestore
+listener does, using plain dicts instead of snapshots.
+"""
+from datetime import datetime, timedelta, timezone
+
+from citizen_index import CategoryRollups, CitizenReportIndex
+
+NOW = datetime(2024, 6, 1, 12, 30, tzinfo=timezone.utc)
+BANGALORE = [12.97, 77.59]
+MUMBAI = [19.07, 72.87]
+
+
+def normalize(doc_id, data):
+    issue = {
+        "id": doc_id,
+        "category": data.get("category", "general"),
+        "timestamp": data.get("createdAt", ""),
+    }
+    if "lat" in data:
+        issue.update(lat=data["lat"], lng=data["lng"], has_coords=True)
+    else:
+        issue["has_coords"] = False
+    return issue
+
+
+def report(category, center=None, created=NOW):
+    data = {"category": category, "createdAt": created}
+    if center:
+        data.update(lat=center[0], lng=center[1])
+    return data
+
+
+def make_index(*cities):
+    index = CitizenReportIndex(normalize)
+    for city_key, center in cities:
+        index.track_city(city_key, center)
+    return index
+
+
+def ids(reports):
+    return sorted(r["id"] for r in reports)
+
+
+def test_added_modified_removed():
+    index = make_index(("bangalore", BANGALORE))
+    index.apply("ADDED", "a", report("pothole", BANGALORE))
+    index.apply("ADDED", "b", report("garbage", BANGALORE))
+    assert index.category_counts("bangalore") == {"pothole": 1, "garbage": 1}
+
+    index.apply("MODIFIED", "a", report("garbage", BANGALORE))
+    assert index.category_counts("bangalore") == {"garbage": 2}
+    assert index.rollups.window(["bangalore"], 24, end=NOW) == {"garbage": 2}
+
+    index.apply("REMOVED", "b")
+    assert ids(index.reports("bangalore")) == ["a"]
+    assert index.rollups.window(["bangalore"], 24, end=NOW) == {"garbage": 1}
+    assert len(index) == 1
+
+
+def test_report_moves_between_cities():
+    index = make_index(("bangalore", BANGALORE), ("mumbai", MUMBAI))
+    index.apply("ADDED", "a", report("pothole", BANGALORE))
+    index.apply("MODIFIED", "a", report("pothole", MUMBAI))
+
+    assert index.reports("bangalore") == []
+    assert ids(index.reports("mumbai")) == ["a"]
+    assert index.category_counts("bangalore") == {}
+    assert index.rollups.window(["bangalore"], 24, end=NOW) == {}
+    assert index.rollups.window(["mumbai"], 24, end=NOW) == {"pothole": 1}
+
+
+def test_overlapping_boxes_share_reports():
+    index = make_index(("bangalore", BANGALORE))
+    index.apply("ADDED", "a", report("pothole", BANGALORE))
+    # Alias tracked later, same centre: gets the existing report too
+    index.track_city("bengaluru", BANGALORE)
+    index.apply("ADDED", "b", report("garbage", BANGALORE))
+
+    assert ids(index.reports("bangalore")) == ["a", "b"]
+    assert ids(index.reports("bengaluru")) == ["a", "b"]
+    assert index.rollups.window(["bengaluru"], 24, end=NOW) == {"pothole": 1, "garbage": 1}
+
+    index.apply("REMOVED", "a")
+    assert ids(index.reports("bangalore")) == ["b"]
+    assert ids(index.reports("bengaluru")) == ["b"]
+    assert index.rollups.window(["bangalore"], 24, end=NOW) == {"garbage": 1}
+
+
+def test_untracked_reports_are_picked_up_when_city_is_tracked():
+    index = make_index()
+    index.apply("ADDED", "a", report("pothole", MUMBAI))
+    assert index.reports("mumbai") == []
+
+    index.track_city("mumbai", MUMBAI)
+    assert ids(index.reports("mumbai")) == ["a"]
+
+
+def test_unlocated_reports_belong_to_no_city():
+    index = make_index(("bangalore", BANGALORE), ("mumbai", MUMBAI))
+    index.apply("ADDED", "t", report("noise"))
+    index.apply("ADDED", "b", report("pothole", BANGALORE, created=NOW - timedelta(hours=1)))
+
+    assert ids(index.reports("bangalore")) == ["b"]
+    assert index.reports("mumbai") == []
+    assert index.category_counts("mumbai") == {}
+    assert index.rollups.window(["bangalore"], 24, end=NOW) == {"pothole": 1}
+    assert len(index) == 2
+
+    # Gaining coordinates places it
+    index.apply("MODIFIED", "t", report("noise", MUMBAI))
+    assert ids(index.reports("mumbai")) == ["t"]
+
+
+def test_rollup_windows_and_series():
+    rollups = CategoryRollups()
+    rollups.add("a", "pune", "pothole", NOW - timedelta(hours=1))
+    rollups.add("b", "pune", "pothole", NOW - timedelta(days=3))
+    rollups.add("c", "pune", "garbage", (NOW - timedelta(days=10)).isoformat())
+
+    assert rollups.window(["pune"], 24, end=NOW) == {"pothole": 1}
+    assert rollups.window(["pune"], 7 * 24, end=NOW) == {"pothole": 2}
+    assert rollups.window(["pune"], 30 * 24, end=NOW) == {"pothole": 2, "garbage": 1}
+    assert [total for _, total in rollups.daily_series(["pune"], 4, end=NOW)] == [1, 0, 0, 1]
+
+    # Re-adding replaces, removing drops
+    rollups.add("a", "pune", "garbage", NOW)
+    rollups.remove("b")
+    assert rollups.window(["pune"], 7 * 24, end=NOW) == {"garbage": 1}
+
+
+def test_rollups_count_a_report_once_per_city():
+    rollups = CategoryRollups()
+    rollups.add("a", "delhi", "pothole", NOW)
+    rollups.add("a", "new delhi", "pothole", NOW)
+    rollups.add("a", "delhi", "pothole", NOW)
+
+    assert rollups.window(["delhi"], 24, end=NOW) == {"pothole": 1}
+    assert rollups.window(["new delhi"], 24, end=NOW) == {"pothole": 1}
+
+    rollups.remove("a", "delhi")
+    assert rollups.window(["delhi"], 24, end=NOW) == {}
+    assert rollups.window(["new delhi"], 24, end=NOW) == {"pothole": 1}
@@ -0,0 +1,91 @@
+"""
+Runs the direct Firestore query path (used while the citizen index is off or
+not ready yet) against the in-memory Firestore from the benchmark fakes.
+"""
+import pytest
+
+for module in ("fastapi", "firebase_admin", "langchain_core", "langgraph"):
+    pytest.importorskip(module)
+
+import deps  # noqa: E402
+import main  # noqa: E402
+from bench.fakes import CITY_CENTRES, FakeFirestore  # noqa: E402
+
+CITIES = ["bangalore", "mumbai", "pune"]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeFirestore(CITIES, reports_per_city=30, text_only_ratio=0.0, latency=0)
+    monkeypatch.setattr(deps, "db", db)
+    return db
+
+
+def test_stream_pages_follows_cursors_up_to_the_cap(fake_db):
+    issues = fake_db.collection("issues")
+    ids = [doc.id for doc in main.stream_pages(issues, main.DOCUMENT_ID, page_size=7, cap=50)]
+    assert len(ids) == 50
+    assert ids == sorted(set(ids))
+
+    every = [doc.id for doc in main.stream_pages(issues, main.DOCUMENT_ID, page_size=7, cap=1000)]
+    assert len(every) == 90
+
+
+def test_fetch_real_firebase_issues_reads_the_city_box(fake_db):
+    reports = main.fetch_real_firebase_issues("Bangalore", CITY_CENTRES["bangalore"])
+    assert len(reports) == 30
+    assert all(report["id"].startswith("bangalore-") for report in reports)
+
+
+def test_fetch_real_firebase_issues_by_city_field(fake_db, monkeypatch):
+    for doc in fake_db.docs:
+        doc._data["location"]["city"] = doc.id.split("-")[0]
+    monkeypatch.setattr(main, "FIRESTORE_CITY_FIELD", "location.city")
+    reports = main.fetch_real_firebase_issues("mumbai")
+    assert len(reports) == 30
+    assert all(report["id"].startswith("mumbai-") for report in reports)
+
+
+def test_batch_fetch_partitions_reports_per_city(fake_db, monkeypatch):
+    centers = {city.title(): CITY_CENTRES[city] for city in CITIES}
+    partitions = main.fetch_firebase_issues_for_cities(centers)
+    assert sorted(partitions) == CITIES
+    for city in CITIES:
+        assert len(partitions[city]) == 30
+        assert all(report["id"].startswith(city + "-") for report in partitions[city])
+
+    # The cap applies to each city, not to the whole pass
+    monkeypatch.setattr(main, "FIRESTORE_MAX_REPORTS", 10)
+    partitions = main.fetch_firebase_issues_for_cities(centers)
+    assert {city: len(reports) for city, reports in partitions.items()} == dict.fromkeys(CITIES, 10)
+
+
+def test_batch_fetch_by_city_field(fake_db, monkeypatch):
+    for doc in fake_db.docs:
+        doc._data["location"]["city"] = doc.id.split("-")[0]
+    monkeypatch.setattr(main, "FIRESTORE_CITY_FIELD", "location.city")
+    partitions = main.fetch_firebase_issues_for_cities(dict.fromkeys(CITIES))
+    assert {city: len(reports) for city, reports in partitions.items()} == dict.fromkeys(CITIES, 30)
+
+
+def test_text_only_reports_are_only_included_by_city_field(monkeypatch):
+    db = FakeFirestore(CITIES, reports_per_city=30, text_only_ratio=0.3, latency=0)
+    monkeypatch.setattr(deps, "db", db)
+    located = {
+        city: {doc.id for doc in db.docs if doc.id.startswith(city + "-") and doc._data["location"]["geopoint"]}
+        for city in CITIES
+    }
+    assert all(len(ids) < 30 for ids in located.values())
+
+    # Box mode: another city's text-only reports must not be counted here
+    reports = main.fetch_real_firebase_issues("Bangalore", CITY_CENTRES["bangalore"])
+    assert {report["id"] for report in reports} == located["bangalore"]
+    partitions = main.fetch_firebase_issues_for_cities({city.title(): CITY_CENTRES[city] for city in CITIES})
+    assert {city: {report["id"] for report in reports} for city, reports in partitions.items()} == located
+
+    # City-field mode: a text-only report names its city, so it is included
+    for doc in db.docs:
+        doc._data["location"]["city"] = doc.id.split("-")[0]
+    monkeypatch.setattr(main, "FIRESTORE_CITY_FIELD", "location.city")
+    reports = main.fetch_real_firebase_issues("bangalore")
+    assert {report["id"] for report in reports} == {doc.id for doc in db.docs if doc.id.startswith("bangalore-")}
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("requests")
+
+import ogd_client  # noqa: E402
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Replaces the API call with a scripted list of responses (None = failure)."""
+    responses = []
+    calls = []
+
+    def fetch(resource_id, filters=None, timeout=None):
+        calls.append(resource_id)
+        return responses.pop(0)
+
+    monkeypatch.setattr(ogd_client, "_fetch_from_api", fetch)
+    ogd_client.ogd_cache.clear()
+    yield responses, calls
+    ogd_client.ogd_cache.clear()
+
+
+def test_failed_miss_is_negative_cached(api):
+    responses, calls = api
+    responses.append(None)
+    assert ogd_client.fetch_ogd_resource("aqi", {"city": "Pune"}) is None
+    assert ogd_client.fetch_ogd_resource("aqi", {"city": " pune "}) is None
+    assert calls == ["aqi"]
+
+
+def test_empty_response_is_negative_cached(api):
+    responses, calls = api
+    responses.append([])
+    assert ogd_client.fetch_ogd_resource("aqi", {"city": "Pune"}) == []
+    assert ogd_client.fetch_ogd_resource("aqi", {"city": "Pune"}) == []
+    assert calls == ["aqi"]
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def test_failed_refresh_keeps_the_stale_copy(api, monkeypatch):
+    responses, calls = api
+    monkeypatch.setattr(ogd_client, "OGD_EXECUTOR", InlineExecutor())
+    key = ogd_client.cache_key("aqi", {"city": "Pune"})
+    ogd_client.ogd_cache.set(key, [{"station": "A"}], ttl=0)
+    responses.append(None)
+
+    # Served stale while the (failing) refresh runs
+    assert ogd_client.fetch_ogd_resource("aqi", {"city": "Pune"}) == [{"station": "A"}]
+    assert calls == ["aqi"]
+    assert ogd_client.ogd_cache.lookup(key) == ([{"station": "A"}], False)
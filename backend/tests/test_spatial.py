@@ -0,0 +1,54 @@
+from spatial import consolidate_reports
+
+
+def text_report(report_id, description, name="Unknown", category="pothole"):
+    return {
+        "id": report_id, "category": category, "location_name": name,
+        "description": description, "has_coords": False,
+    }
+
+
+def located_report(report_id, lat, lng, category="pothole", description="Pothole"):
+    return {
+        "id": report_id, "category": category, "location_name": "Unknown",
+        "description": description, "lat": lat, "lng": lng, "has_coords": True,
+    }
+
+
+def test_placeholder_names_are_not_merged():
+    clusters = consolidate_reports([
+        text_report("a", "Big pothole on MG Road"),
+        text_report("b", "Pothole near Indiranagar metro"),
+        text_report("c", "Crater outside Koramangala 5th block"),
+    ])
+    assert sorted(c["description"] for c in clusters) == [
+        "Big pothole on MG Road", "Crater outside Koramangala 5th block", "Pothole near Indiranagar metro",
+    ]
+
+
+def test_exact_duplicates_merge_even_without_a_name():
+    clusters = consolidate_reports([
+        text_report("a", "Big pothole on MG Road"),
+        text_report("b", "big  pothole on MG road"),
+    ])
+    assert len(clusters) == 1
+    assert clusters[0]["report_count"] == 2
+    assert clusters[0]["report_ids"] == ["a", "b"]
+
+
+def test_named_text_reports_merge_by_place():
+    clusters = consolidate_reports([
+        text_report("a", "Huge pothole", name="MG Road"),
+        text_report("b", "Road broken", name="mg road"),
+        text_report("c", "Road broken", name="mg road", category="garbage"),
+    ])
+    assert sorted(c["report_count"] for c in clusters) == [1, 2]
+
+
+def test_nearby_reports_cluster_and_far_ones_do_not():
+    clusters = consolidate_reports([
+        located_report("a", 12.9716, 77.5946),
+        located_report("b", 12.9717, 77.5947, description="Another pothole"),
+        located_report("c", 12.9816, 77.5946),
+    ])
+    assert sorted(c["report_count"] for c in clusters) == [1, 2]
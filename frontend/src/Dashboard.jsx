@@ -180,7 +180,9 @@ export default function Dashboard({ cityName, onBack }) {
       });
       setChatHistory(prev => [...prev, { role: 'ai', content: response.data.reply }]);
     } catch (error) {
-      setChatHistory(prev => [...prev, { role: 'ai', content: "Sorry, I lost connection to the neural network." }]);
+      // 503 = the server is busy; its reply says when to try again
+      const busyReply = error.response?.status === 503 && error.response.data?.reply;
+      setChatHistory(prev => [...prev, { role: 'ai', content: busyReply || "Sorry, I lost connection to the neural network." }]);
     } finally {
       setChatLoading(false);
     }